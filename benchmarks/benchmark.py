@@ -6,7 +6,7 @@ License: MIT
 
 """
 
-import time
+import gc, time
 
 
 def benchmark(function,
@@ -14,7 +14,8 @@ def benchmark(function,
               minimum_time=1e-9,
               get_time=time.time,
               unbenchmarked_first_call=True,
-              no_operation=lambda: None):
+              no_operation=lambda: None,
+              disable_gc=True):
     """ Runs the given function as many times as it can in the given
     period of time
     
@@ -33,6 +34,9 @@ def benchmark(function,
         to substract some internal operations or calls from the final
         results, then it might be useful to override this
     
+    disable_gc: set to False to allow the garbage collector to run while
+        timing the function, it is disabled by default like in timeit
+    
     Returns the time needed to execute a single function call in average,
     substracting the empty benchmark loop and the function call itself.
     
@@ -61,15 +65,24 @@ def benchmark(function,
     et = st + period 
     
     # Run the function as many times as we can in the given period of time
-    count = 0
-    while 1:
-        function()
-        count += 1
-        if get_time() > et:
-            break
-        
-    # Calculate the average execution time
-    et = get_time()
+    # NOTE: The garbage collection pauses would make the results noisy, since
+    #       they depend on the allocations made before the benchmark started.
+    gc_was_enabled = gc.isenabled()
+    if disable_gc:
+        gc.disable()
+    try:
+        count = 0
+        while 1:
+            function()
+            count += 1
+            if get_time() > et:
+                break
+            
+        # Calculate the average execution time
+        et = get_time()
+    finally:
+        if gc_was_enabled:
+            gc.enable()
     t = (et - st) / count - nop_time
     return max(minimum_time, t)
 
@@ -15,6 +15,10 @@ Requires Python 2.6 and lxml:
  * http://pypi.python.org/pypi/lxml
  * http://lxml.de/
 
+The template compiler module can optionally be compiled with Cython for
+faster compilation of templates. Set the GENSHI_COMPILER_CYTHON environment
+variable while installing the package to enable it, Cython is required then.
+
 License: MIT
 
 Please see the following directories in the source distribution:
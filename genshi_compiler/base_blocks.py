@@ -19,6 +19,9 @@ class BaseBlock(object):
     depth: integer level of source code indentation
     
     Please note, that subclasses must also include __slots__ to conserve memory!
+    Subclasses must list only their new member variables in __slots__, since
+    listing the inherited ones again would allocate them once more. Use the
+    get_slot_names class method to get the names of all the slots.
     
     """
     __slots__ = (
@@ -65,7 +68,7 @@ class BaseBlock(object):
     def __str__(self):
         member_variables = [
             (name, getattr(self, name))
-            for name in self.__slots__]
+            for name in self.get_slot_names()]
         member_variables = ', '.join(
             ('%s=%s(...)' % (name, value.__class__.__name__)
              if isinstance(value, BaseBlock)
@@ -141,6 +144,27 @@ class BaseBlock(object):
         
     ### Queries
 
+    # Maps the block classes to the names of all of their slots,
+    # it is filled on demand by the get_slot_names class method
+    slot_names_map = {}
+    
+    @classmethod
+    def get_slot_names(cls):
+        """ Returns the names of all the slots of the block class,
+        including the inherited ones
+        
+        The result is computed only once for each class.
+        
+        """
+        slot_names = BaseBlock.slot_names_map.get(cls)
+        if slot_names is None:
+            slot_names = []
+            for base_class in reversed(cls.__mro__):
+                slot_names.extend(base_class.__dict__.get('__slots__', ()))
+            slot_names = tuple(slot_names)
+            BaseBlock.slot_names_map[cls] = slot_names
+        return slot_names
+    
     def is_empty(self):
         """ Returns True if the block can't generate any output for sure
         and is not needed for the structure of the generated code for
@@ -190,12 +214,21 @@ class BaseBlock(object):
             
         return lines
     
-    def format_children(self, depth):
-        lines = []
+    def format_children(self, depth, lines=None):
+        """ Formats the source code of the child blocks
+        
+        lines: list to append the code lines to, a new list is
+            created if not given
         
+        Returns the list of code lines.
+        
+        """
+        if lines is None:
+            lines = []
+        
+        extend = lines.extend
         for child in self.children:
-            child_lines = child.format(depth)
-            lines.extend(child_lines)
+            extend(child.format(depth))
 
         return lines
     
@@ -208,7 +241,7 @@ class BaseBlock(object):
             
             member_variables = [
                 (name, getattr(self, name))
-                for name in self.__slots__
+                for name in self.get_slot_names()
                 if name != 'template_line']
             
             contains_any_block = False
@@ -292,7 +325,7 @@ class BaseFramedBlock(BaseBlock):
     given as source code templates
     
     """
-    __slots__ = BaseBlock.__slots__
+    __slots__ = ()
     
     # Multiline source code templates for the header and footer parts
     header_template = ''
@@ -308,7 +341,10 @@ class BaseFramedBlock(BaseBlock):
         footer = util.split_source_to_lines(footer_source, depth)
         
         # Construct function definition
-        lines = header + body + footer
+        # NOTE: Extending the header avoids building an intermediate list.
+        lines = header
+        lines.extend(body)
+        lines.extend(footer)
         
         if constants.GENERATE_DEBUG_COMMENTS:
             self.insert_debug_comment(lines, depth)
@@ -321,7 +357,7 @@ class BaseCodeBlock(BaseBlock):
     These blocks must not have any child elements.
     
     """
-    __slots__ = BaseBlock.__slots__
+    __slots__ = ()
 
     def __init__(self,
                  lineno,
@@ -364,7 +400,7 @@ class BaseCodeBlock(BaseBlock):
 class DummyBlock(BaseBlock):
     """ Block without additional functionality to group other blocks
     """
-    __slots__ = BaseBlock.__slots__
+    __slots__ = ()
     
 class ModuleBlock(BaseFramedBlock):
     """ Block representing the whole generated program module
@@ -372,7 +408,7 @@ class ModuleBlock(BaseFramedBlock):
     The data is the template compiler instance.
     
     """
-    __slots__ = BaseFramedBlock.__slots__
+    __slots__ = ()
 
     def is_empty(self):
         return False
@@ -406,7 +442,7 @@ class FunctionDefinitionBlock(BaseFramedBlock):
     The data is the signature of the function, like: fn(a, b=2, c=3)
     
     """
-    __slots__ = BaseFramedBlock.__slots__
+    __slots__ = ()
     
     # Template for the body of empty function definitions
     empty_body_template = ''
@@ -465,7 +501,7 @@ class LoopBlock(BaseBlock):
     programming language, at least a limited subset of such expressions.
     
     """
-    __slots__ = BaseBlock.__slots__
+    __slots__ = ()
 
 class ConditionalBlock(BaseBlock):
     """ Conditional block
@@ -473,7 +509,7 @@ class ConditionalBlock(BaseBlock):
     The data is an expression to evaluate runtime to get a truth value.
     
     """
-    __slots__ = BaseBlock.__slots__
+    __slots__ = ()
     
 class SwitchBlock(BaseBlock):
     """ Block resulting from the compilation of a py:choose directive
@@ -484,7 +520,7 @@ class SwitchBlock(BaseBlock):
     expressions.
     
     """
-    __slots__ = BaseBlock.__slots__ + (
+    __slots__ = (
         'when_blocks',
         'otherwise_blocks',
         'prepared')
@@ -523,7 +559,7 @@ class CaseBlock(BaseBlock):
     The data is an expression to evaluate runtime to get a truth value.
     
     """
-    __slots__ = BaseBlock.__slots__
+    __slots__ = ()
 
     def format(self, depth=0):
         return self.format_children(depth)
@@ -531,7 +567,7 @@ class CaseBlock(BaseBlock):
 class OtherwiseBlock(BaseBlock):
     """ Block resulting from the compilation of a py:otherwise directive
     """
-    __slots__ = BaseBlock.__slots__
+    __slots__ = ()
 
     def format(self, depth=0):
         return self.format_children(depth)
@@ -542,7 +578,7 @@ class WithBlock(BaseBlock):
     The data is the semicolon separated list of local variable assignments.
     
     """
-    __slots__ = BaseBlock.__slots__
+    __slots__ = ()
     
 ### Element hierarchy
 
@@ -552,7 +588,7 @@ class ElementBlock(BaseBlock):
     The data is the lower case tag name without the XML namespace prefix.
     
     """
-    __slots__ = BaseBlock.__slots__ + (
+    __slots__ = (
         'start_tag',
         'end_tag',
         'strip_expression',
@@ -643,7 +679,7 @@ class OpeningTagBlock(BaseBlock):
     The data is the lower case tag name without the XML namespace prefix.
     
     """
-    __slots__ = BaseBlock.__slots__
+    __slots__ = ()
     
 # FIXME: This block class would not be needed if element_block.end_tag would be a list of blocks.
 class ClosingTagBlock(BaseBlock):
@@ -652,7 +688,7 @@ class ClosingTagBlock(BaseBlock):
     The data is the lower case tag name without the XML namespace prefix.
     
     """
-    __slots__ = BaseBlock.__slots__
+    __slots__ = ()
     
     def is_invariant(self):
         return True
@@ -664,14 +700,14 @@ class AttributeValueBlock(BaseBlock):
     prefix if any.
     
     """
-    __slots__ = BaseBlock.__slots__
+    __slots__ = ()
     
 ### Generated source code blocks
 
 class InvariantBlock(BaseCodeBlock):
     """ Common base class for code blocks emitting invariant markup or text
     """
-    __slots__ = BaseCodeBlock.__slots__
+    __slots__ = ()
 
     def is_empty(self):
         return not self.data
@@ -692,7 +728,7 @@ class MarkupBlock(InvariantBlock):
     without escaping.
     
     """
-    __slots__ = InvariantBlock.__slots__
+    __slots__ = ()
 
     def get_markup(self):
         return self.data
@@ -703,7 +739,7 @@ class AttributeValueFragmentBlock(InvariantBlock):
     The data is the original (non-escaped) text.
     
     """
-    __slots__ = InvariantBlock.__slots__
+    __slots__ = ()
 
     def get_markup(self):
         return util.escape_attribute(self.data)
@@ -714,7 +750,7 @@ class TextBlock(InvariantBlock):
     The data is the original (non-escaped) text.
     
     """
-    __slots__ = InvariantBlock.__slots__
+    __slots__ = ()
 
     def get_markup(self):
         return util.escape_text(self.data)
@@ -722,15 +758,41 @@ class TextBlock(InvariantBlock):
     def get_i18n_text(self):
         return self.data
     
+class LiteralBlock(object):
+    """ Mixin class marking the invariant blocks folded from literal
+    expressions at compile time
+    
+    The whitespace of literal expressions is part of the value, so it is
+    not reduced by the optimizer.
+    
+    """
+    __slots__ = ()
+
+class LiteralMarkupBlock(MarkupBlock, LiteralBlock):
+    """ Code block emitting raw markup folded from a literal expression
+    """
+    __slots__ = ()
+
+class LiteralAttributeValueFragmentBlock(AttributeValueFragmentBlock, LiteralBlock):
+    """ Code block emitting XML attribute escaped text folded from
+    a literal expression
+    """
+    __slots__ = ()
+
+class LiteralTextBlock(TextBlock, LiteralBlock):
+    """ Code block emitting XML escaped text folded from a literal expression
+    """
+    __slots__ = ()
+    
 class ExpressionBlock(BaseCodeBlock):
     """ Base class for the expression blocks
     """
-    __slots__ = BaseCodeBlock.__slots__
+    __slots__ = ()
     
 class TranslatableExpressionBlock(ExpressionBlock):
     """ Base class for expressing blocks can play a role in i18n:msg directives
     """
-    __slots__ = ExpressionBlock.__slots__ + (
+    __slots__ = (
         'parameter_name', )
     
     def __init__(self,
@@ -754,7 +816,7 @@ class MarkupExpressionBlock(TranslatableExpressionBlock):
     is written to the output without escaping.
     
     """
-    __slots__ = TranslatableExpressionBlock.__slots__
+    __slots__ = ()
     
 class TextExpressionBlock(TranslatableExpressionBlock):
     """ Code block emitting the result of a runtime evaluated expression
@@ -764,7 +826,7 @@ class TextExpressionBlock(TranslatableExpressionBlock):
     is escaped, then written to the output.
     
     """
-    __slots__ = TranslatableExpressionBlock.__slots__
+    __slots__ = ()
     
 class AttributeExpressionBlock(ExpressionBlock):
     """ Code block emitting the result of a runtime evaluated expression
@@ -774,7 +836,7 @@ class AttributeExpressionBlock(ExpressionBlock):
     is attribute escaped, then written to the output.
     
     """
-    __slots__ = ExpressionBlock.__slots__
+    __slots__ = ()
     
 class DynamicAttributesBlock(BaseCodeBlock):
     """ Block representing code adding attributes at runtime (py:attrs)
@@ -788,11 +850,12 @@ class DynamicAttributesBlock(BaseCodeBlock):
     into the output instead, which might render the document invalid.
     
     """
-    __slots__ = BaseCodeBlock.__slots__
+    __slots__ = ()
 
 class StaticCodeBlock(BaseCodeBlock):
     """ Block representing static code, like the one in processing instructions
     """
+    __slots__ = ()
     
     def is_invariant(self):
         return True
@@ -9,7 +9,7 @@ common logic and functionality.
 
 """
 
-import os, itertools
+import os, copy, itertools
 
 import lxml
 from lxml import etree
@@ -22,7 +22,8 @@ class BaseXMLTemplateCompiler(object):
     
     Provides the common logic required to compile a Genshi XML template
     to source code written in any programming language. The Genshi template
-    is fully read into memory, then parsed into an element tree.
+    is parsed into an element tree, template files are fed to the parser
+    in chunks while reading them.
     
     """
     
@@ -55,6 +56,27 @@ class BaseXMLTemplateCompiler(object):
     # NOTE: It would be handy, but disabled for Genshi compatibility.
     remove_html_comments = False
     
+    # Enables caching the parsed templates loaded from files. Cached templates
+    # are looked up by the real path, modification time, size and parsing
+    # options of the template file, so modified templates are parsed again.
+    # It is useful only if the same template files are loaded repeatedly.
+    cache_parsed_templates = False
+    
+    # Maximum number of parsed templates to keep in the cache
+    parse_cache_size = 64
+    
+    # Number of bytes (characters) to read at once from template files
+    parse_chunk_size = 65536
+    
+    ### Parse cache
+    ### (shared by all the compiler instances)
+    
+    # Maps parse cache keys to the root element of the parsed templates
+    parse_cache = {}
+    
+    # Parse cache keys in the order of storing them, the first is the oldest
+    parse_cache_keys = []
+    
     ### Overridables
     ### (overridden by subclasses to implement the various language targets)
     
@@ -68,6 +90,9 @@ class BaseXMLTemplateCompiler(object):
         # Output standard, either 'xml' or 'xhtml' during the compilation phase
         self.output_standard = ''
         
+        # True if the output standard is 'xhtml', resolved once per compilation
+        self.xhtml_output = False
+        
         # Template filename, used only in source code comments and compile time exceptions
         self.template_filename = ''
         
@@ -86,18 +111,46 @@ class BaseXMLTemplateCompiler(object):
         self.translator_ungettext = None
         self.translatable_elements = None
         self.translatable_attributes = None
-        self.translatable_element_set = set()
-        self.translatable_attribute_set = set()
+        self.translatable_element_set = frozenset()
+        self.translatable_attribute_set = frozenset()
         
         if constants.GENERATE_DEBUG_COMMENTS:
             # Lines of the XML template, used to quote the XML in debug comments
-            self.template_lines = []
+            self.template_lines = ()
             
         # Maps XML URLs to prefixes for all the XML namespaces can happen
         # in the output of the compiled template. It does not contain the
         # XML namespaces corresponding to Genshi directives.
         self.namespace_map = {}
         
+        # Items of the namespace map sorted by URL, it is built once
+        # per compilation for the namespace declarations
+        self.sorted_namespace_items = []
+        
+        # Maps the tag and attribute names in lxml's notation to their
+        # prefixed format, it is filled while compiling the template
+        self.prefixed_name_map = {}
+        
+        # Maps static markup strings to a single instance of each, it is
+        # filled while compiling the template
+        self.markup_map = {}
+        
+        # Maps template expressions to their ASCII encoded form, it is
+        # filled while compiling the template
+        self.expression_map = {}
+        
+        # Maps translatable text fragments to their translation, it is
+        # filled while compiling the template
+        self.translation_map = {}
+        
+        # Maps i18n:msg string templates to their translation and its items,
+        # it is filled while compiling the template
+        self.i18n_msg_template_map = {}
+        
+        # Maps (expression, default) pairs of py:if and py:strip directives
+        # to their parsed value, it is filled while compiling the template
+        self.boolean_expression_map = {}
+        
         # Module block
         self.module_block = None
         
@@ -114,6 +167,17 @@ class BaseXMLTemplateCompiler(object):
             (lxml_name, getattr(self, 'compile_' + directive.replace(':', '_')))
             for lxml_name, directive in zip(constants.GENSHI_ATTRIBUTES_WITH_URL, constants.GENSHI_ATTRIBUTES))
         
+        # Map of optimizer methods for each block class needing class
+        # specific optimizations, see the optimize_block method
+        blocks_module = self.blocks_module
+        self.block_optimizer_map = {
+            blocks_module.WithBlock: self.optimize_with_block,
+            blocks_module.AttributeValueBlock: self.extract_invariant_blocks,
+            blocks_module.ElementBlock: self.optimize_element_block,
+            blocks_module.MarkupBlock: self.reduce_block_whitespace,
+            blocks_module.TextBlock: self.reduce_block_whitespace,
+            }
+        
     def load(self,
              template_source,
              template_filename='',
@@ -166,15 +230,47 @@ class BaseXMLTemplateCompiler(object):
         self.template_identifier = template_identifier or 'unnamed_template'
         self.template_encoding = template_encoding
         
-        # Load the template from a file object if needed
-        if not isinstance(template_source, basestring):
-            template_source = template_source.read()
-
-        if constants.GENERATE_DEBUG_COMMENTS:
-            self.template_lines = template_source.splitlines()
-            # Allow indexing template lines from 1, since the element.sourceline
-            # values are starting from 1, not zero
-            self.template_lines.insert(0, '')
+        # Look up the template in the parse cache if enabled
+        parse_cache_key = None
+        if self.cache_parsed_templates:
+            parse_cache_key = self.get_parse_cache_key(
+                template_source, template_encoding, parser_parameters)
+        cached_template = self.parse_cache.get(parse_cache_key)
+        
+        # NOTE: The template source is needed for the debug comments,
+        #       so the parse cache is not used while generating them.
+        if cached_template is not None and not constants.GENERATE_DEBUG_COMMENTS:
+            
+            # Copy the cached template, since compiling it modifies the tree
+            self.template = self.copy_template(cached_template)
+        
+        else:
+            self.parse(template_source, template_encoding, parser_parameters)
+            
+            if parse_cache_key is not None:
+                self.store_parsed_template(parse_cache_key, self.template)
+        
+        # Prepare namespace map and reverse map based on the actual
+        # namespace declarations of the template loaded
+        self.namespace_map = dict(
+            (url, prefix)
+            for prefix, url in self.template.nsmap.iteritems()
+            if url not in constants.XML_NAMESPACES_PROCESSED)
+    
+    def parse(self, template_source, template_encoding, parser_parameters):
+        """ Parses the XML template and stores its root element
+        
+        See the load method for the parameters.
+        
+        """
+        # Feed template files to the parser in chunks, so we don't need to
+        # keep the whole source in memory while parsing it
+        if isinstance(template_source, basestring):
+            chunks = (template_source, )
+        else:
+            read_chunk = template_source.read
+            chunk_size = self.parse_chunk_size
+            chunks = iter(lambda: read_chunk(chunk_size), '')
 
         # Create the appropriate parser and configure it
         kws = dict(
@@ -183,45 +279,134 @@ class BaseXMLTemplateCompiler(object):
             ns_clean=True)
         kws.update(parser_parameters)
         parser = etree.XMLParser(**kws)
-
-        if self.template_standard == 'xhtml':
-            #kws['load_dtd'] = True
+        
+        # The DTD for the entities is prepended to the first chunk
+        # NOTE: The first chunk determines whether the parser is fed by
+        #       str or unicode data, so the DTD is concatenated to it
+        #       instead of feeding it separately.
+        xhtml = self.template_standard == 'xhtml'
+        first_chunk = True
+        leading_text = ''
+        
+        if constants.GENERATE_DEBUG_COMMENTS:
+            source_chunks = []
+        
+        for chunk in chunks:
+            if not chunk:
+                continue
             
-            # Fail on existing DOCTYPE
-            assert not template_source.lstrip().startswith('<!'), (
-                "Please remove the current <!DOCTYPE > definition or "
-                "set the template_standard to 'xml'!")
+            if constants.GENERATE_DEBUG_COMMENTS:
+                source_chunks.append(chunk)
+            
+            if xhtml and leading_text is not None:
+                # Fail on existing DOCTYPE
+                leading_text = (leading_text + chunk).lstrip()
+                if len(leading_text) >= 2:
+                    assert not leading_text.startswith('<!'), (
+                        "Please remove the current <!DOCTYPE > definition or "
+                        "set the template_standard to 'xml'!")
+                    leading_text = None
+            
+            if first_chunk:
+                if xhtml:
+                    #kws['load_dtd'] = True
+                    chunk = constants.DOCTYPE_AND_HTML_ENTITIES + chunk
+                first_chunk = False
             
-            # Prepend the DTD for the entities
-            # FIXME: It would be faster to feed it to the parser before the document.
-            template_source = constants.DOCTYPE_AND_HTML_ENTITIES + template_source
+            parser.feed(chunk)
         
-        # Parse and store the template
-        self.template = etree.fromstring(template_source, parser)
+        # Store the parsed template
+        self.template = parser.close()
         
-        # Prepare namespace map and reverse map based on the actual
-        # namespace declarations of the template loaded
-        self.namespace_map = dict(
-            (url, prefix)
-            for prefix, url in self.template.nsmap.iteritems()
-            if url not in constants.XML_NAMESPACES_PROCESSED)
+        if constants.GENERATE_DEBUG_COMMENTS:
+            # Allow indexing template lines from 1, since the element.sourceline
+            # values are starting from 1, not zero
+            self.template_lines = ('', ) + tuple(''.join(source_chunks).splitlines())
+    
+    ### Parse cache
+    
+    def get_parse_cache_key(self, template_source, template_encoding, parser_parameters):
+        """ Returns the parse cache key of a template or None if the template
+        can't be cached
+        
+        Only templates loaded from real files can be cached, since the key
+        includes the modification time and size of the file.
+        
+        """
+        if isinstance(template_source, basestring):
+            return None
+        
+        try:
+            template_path = os.path.realpath(template_source.name)
+            template_stat = os.fstat(template_source.fileno())
+            parser_parameters_key = tuple(sorted(parser_parameters.iteritems()))
+            hash(parser_parameters_key)
+        except (AttributeError, TypeError, ValueError, EnvironmentError):
+            return None
+        
+        return (
+            template_path,
+            template_stat.st_mtime,
+            template_stat.st_size,
+            self.template_standard,
+            template_encoding,
+            parser_parameters_key)
+    
+    def store_parsed_template(self, parse_cache_key, template):
+        """ Stores a copy of the parsed template in the parse cache,
+        drops the oldest cached template if the cache is full
+        """
+        parse_cache = self.parse_cache
+        parse_cache_keys = self.parse_cache_keys
         
+        if parse_cache_key not in parse_cache:
+            while parse_cache_keys and len(parse_cache_keys) >= self.parse_cache_size:
+                del parse_cache[parse_cache_keys.pop(0)]
+            parse_cache_keys.append(parse_cache_key)
+        
+        parse_cache[parse_cache_key] = self.copy_template(template)
+    
+    def copy_template(self, template):
+        """ Returns a deep copy of a parsed template
+        
+        lxml copies the source line numbers of the elements only, so they
+        are restored for the comments and processing instructions. Entity
+        references still lose their line numbers.
+        
+        """
+        template_copy = copy.deepcopy(template)
+        
+        node_types = (etree.Comment, etree.ProcessingInstruction)
+        for node, node_copy in itertools.izip(
+            template.iter(*node_types), template_copy.iter(*node_types)):
+            node_copy.sourceline = node.sourceline
+        
+        return template_copy
+    
     def cleanup(self):
         """ Cleanup function, clears the loaded template
         """
         self.output_standard = ''
+        self.xhtml_output = False
         self.template_filename = ''
         self.template_identifier = ''
         self.template = None
         self.translator = None
         self.translator_ugettext = None
         self.translator_ungettext = None
-        self.translatable_element_set.clear()
-        self.translatable_attribute_set.clear()
+        self.translatable_element_set = frozenset()
+        self.translatable_attribute_set = frozenset()
         self.namespace_map.clear()
+        del self.sorted_namespace_items[:]
+        self.prefixed_name_map.clear()
+        self.markup_map.clear()
+        self.expression_map.clear()
+        self.translation_map.clear()
+        self.i18n_msg_template_map.clear()
+        self.boolean_expression_map.clear()
         self.function_map.clear()
         if constants.GENERATE_DEBUG_COMMENTS:
-            self.template_lines = []
+            self.template_lines = ()
 
     ### Configuration
     
@@ -324,6 +509,7 @@ class BaseXMLTemplateCompiler(object):
         # Validate output standard
         assert output_standard in ('xml', 'xhtml')
         self.output_standard = output_standard
+        self.xhtml_output = output_standard == 'xhtml'
         
         # Finalize i18n settings
         if self.translator:
@@ -333,17 +519,17 @@ class BaseXMLTemplateCompiler(object):
             self.translator_ungettext = self.translator.ungettext
             
             # Defaults
-            if output_standard == 'xhtml':
+            if self.xhtml_output:
                 default_translatable_elements = constants.XHTML_ELEMENTS_TO_TRANSLATE
                 default_translatable_attributes = constants.XHTML_ATTRIBUTES_TO_TRANSLATE
             else:
                 default_translatable_elements = ()
                 default_translatable_attributes = ()
                 
-            # Turn the lists into sets
-            self.translatable_element_set = set(
+            # Turn the lists into sets, they are not modified during compilation
+            self.translatable_element_set = frozenset(
                 self.translatable_elements or default_translatable_elements)
-            self.translatable_attribute_set = set(
+            self.translatable_attribute_set = frozenset(
                 self.translatable_attributes or default_translatable_attributes)
         
         # Recursively build up the compiled module
@@ -351,6 +537,15 @@ class BaseXMLTemplateCompiler(object):
         #       so the render function will be the last one defined.
         self.function_map.clear()
         
+        # The namespace map might have changed since the last compilation
+        self.sorted_namespace_items = sorted(self.namespace_map.iteritems())
+        self.prefixed_name_map.clear()
+        self.markup_map.clear()
+        self.expression_map.clear()
+        self.translation_map.clear()
+        self.i18n_msg_template_map.clear()
+        self.boolean_expression_map.clear()
+        
         self.module_block = blocks_module.ModuleBlock(lineno, self)
         
         main_block = self.compile_element(self.template, self.namespace_map)
@@ -366,6 +561,11 @@ class BaseXMLTemplateCompiler(object):
                 self.template,
                 'render(%s)' % arguments)
         
+        # The element tree is not needed anymore, since it has been modified
+        # and fully translated to blocks. Releasing it before postprocessing
+        # avoids keeping both the element and the block trees in memory.
+        self.template = None
+        
         self.dump_block_tree(
             self.module_block,
             constants.DUMP_BLOCK_TREE_BEFORE_POSTPROCESSING,
@@ -380,18 +580,12 @@ class BaseXMLTemplateCompiler(object):
         self.module_block = result[0]
 
         if constants.PRINT_POSTPROCESSING_DIFFERENCE:
-            after_postprocessing_dump = self.module_block.pretty_format()
-            print 'Postprocessing difference:'
-            print
-            if before_postprocessing_dump == after_postprocessing_dump:
-                print 'No difference.'
-            else:
-                util.print_diff(
-                    before_postprocessing_dump,
-                    after_postprocessing_dump,
-                    'Before postprocessing',
-                    'After postprocessing')
-            print
+            self.print_block_tree_difference(
+                before_postprocessing_dump,
+                self.module_block,
+                'Postprocessing difference:',
+                'Before postprocessing',
+                'After postprocessing')
         
         self.dump_block_tree(
             self.module_block,
@@ -414,18 +608,12 @@ class BaseXMLTemplateCompiler(object):
                 'Block tree after code optimization:')
         
             if constants.PRINT_OPTIMIZATION_DIFFERENCE:
-                after_optimization_dump = self.module_block.pretty_format()
-                print 'Optimization difference:'
-                print
-                if before_optimization_dump == after_optimization_dump:
-                    print 'No difference.'
-                else:
-                    util.print_diff(
-                        before_optimization_dump,
-                        after_optimization_dump,
-                        'Before optimization',
-                        'After optimization')
-                print
+                self.print_block_tree_difference(
+                    before_optimization_dump,
+                    self.module_block,
+                    'Optimization difference:',
+                    'Before optimization',
+                    'After optimization')
         
         # Recursively format the hierarchy of blocks into actual source code lines
         lines = self.module_block.format()
@@ -436,18 +624,25 @@ class BaseXMLTemplateCompiler(object):
                 assert depth >= 0
                 assert isinstance(code, str)
                 
-        # Reduce duplicate empty lines
-        if len(lines) > 1:
-            for index in xrange(len(lines) - 1, 0, -1):
-                if lines[index - 1][1].strip() or lines[index][1].strip():
-                    continue
-                del lines[index]
-        
-        # Construct the indented source code string
+        # Reduce duplicate empty lines in a single pass
+        reduced_lines = []
+        previous_line_is_empty = False
+        for depth, code in lines:
+            line_is_empty = not code.strip()
+            if line_is_empty and previous_line_is_empty:
+                continue
+            reduced_lines.append((depth, code))
+            previous_line_is_empty = line_is_empty
+        lines = reduced_lines
+        
+        # Construct the indented source code string, the indentation strings
+        # are built only once for each depth
         indentation = self.indentation
-        module_source = '\n'.join(
-            indentation * depth + code
-            for depth, code in lines)
+        maximum_depth = max(depth for depth, code in lines) if lines else 0
+        indentation_list = [indentation * depth for depth in xrange(maximum_depth + 1)]
+        module_source = '\n'.join([
+            indentation_list[depth] + code
+            for depth, code in lines])
         assert isinstance(module_source, str)
         
         # Ensure that we have a newline after the last code line
@@ -461,26 +656,73 @@ class BaseXMLTemplateCompiler(object):
         return module_source
     
     def compile_element(self, element, namespace_map=None):
-        """ Compiles a template element (recursive)
+        """ Compiles a template element including all of its children
         
         element: lxml Element to compile.
         
+        The subtree is walked by lxml's iterwalk instead of Python level
+        recursion. The block of each element is built on its start event,
+        then finished on its end event after all of its children has been
+        appended to it.
+        
         Returns a block representing the compiled element.
         
+        """
+        # Stack of (block, genshi_attributes, child_namespace_map) tuples
+        # for the elements being compiled, the innermost one is the last
+        stack = []
+        
+        block = None
+        for event, node in etree.iterwalk(
+            element, events=('start', 'end', 'comment', 'pi')):
+            
+            if event == 'start':
+                parent_namespace_map = stack[-1][2] if stack else namespace_map
+                stack.append(self.compile_element_start(node, parent_namespace_map))
+                continue
+            
+            if event == 'end':
+                node_block, genshi_attributes, child_namespace_map = stack.pop()
+            else:
+                # Comments and processing instructions have no children
+                node_block, genshi_attributes, child_namespace_map = (
+                    self.compile_element_start(node, None))
+            
+            block = self.compile_element_end(node, node_block, genshi_attributes)
+            
+            if stack:
+                stack[-1][0].append(block)
+        
+        return block
+    
+    def compile_element_start(self, element, namespace_map=None):
+        """ Compiles a template element without its children and tail
+        
+        element: lxml Element to compile.
+        
+        Returns a (block, genshi_attributes, child_namespace_map) tuple,
+        where genshi_attributes is the list of Genshi directives to apply
+        when finishing the element or None for non-element nodes and
+        child_namespace_map is the namespace map to pass to the children.
+        
         """
         escape_text = util.escape_text
         blocks_module = self.blocks_module
-        lineno = element.sourceline
+        # NOTE: Entity references of templates copied from the parse cache
+        #       have no line number, see the copy_template method.
+        lineno = element.sourceline or 0
+        genshi_attributes = None
+        child_namespace_map = None
         
         # Identify the element's type
         if element.tag is etree.ProcessingInstruction:
             # Processing instruction
+            # NOTE: The code block is returned as is, it needs no wrapping.
             code = element.text
-            block = blocks_module.DummyBlock(lineno)
-            block.append(blocks_module.StaticCodeBlock(lineno, code))
+            block = blocks_module.StaticCodeBlock(lineno, code)
             if constants.GENERATE_DEBUG_COMMENTS:
                 block.template_line = ''
-            
+        
         elif element.tag is etree.Comment:
             # XML comment
             block = blocks_module.DummyBlock(lineno)
@@ -516,10 +758,8 @@ class BaseXMLTemplateCompiler(object):
             assert isinstance(element.tag, basestring), 'Unknown element: %r' % element
             
             # Is this element i18n translatable?
-            lc_tagname_with_namespace_prefix = (
-                util.namespace_url_to_prefix(self.namespace_map, element.tag))
-            translatable_element = (
-                lc_tagname_with_namespace_prefix in self.translatable_element_set)
+            tag_name = self.get_prefixed_name(element.tag)
+            translatable_element = tag_name in self.translatable_element_set
             
             # Translate genshi element to their attribute format in place
             element_translator = self.element_translator_map.get(element.tag)
@@ -532,12 +772,20 @@ class BaseXMLTemplateCompiler(object):
             # from the element in the process. The resulting list is in reverse
             # processing order, since we build up the generated code from the
             # deeper structure to the top level one.
+            # NOTE: Most of the elements have no Genshi attributes at all,
+            #       so we look for them only among the actual attributes.
             genshi_attributes = []
-            directive_compiler = None
-            for attribute_name in constants.GENSHI_ATTRIBUTES_WITH_URL:
-                attribute_value = element.attrib.pop(attribute_name, None)
-                if attribute_value is not None:
-                    directive_compiler = self.attribute_compiler_map.get(attribute_name)
+            genshi_attribute_names = [
+                attribute_name
+                for attribute_name in element.attrib.iterkeys()
+                if attribute_name in constants.GENSHI_ATTRIBUTES_WITH_URL_SET]
+            if genshi_attribute_names:
+                genshi_attribute_names.sort(
+                    key=constants.GENSHI_ATTRIBUTE_ORDER_MAP.__getitem__)
+                attribute_compiler_map = self.attribute_compiler_map
+                for attribute_name in genshi_attribute_names:
+                    attribute_value = element.attrib.pop(attribute_name)
+                    directive_compiler = attribute_compiler_map[attribute_name]
                     genshi_attributes.append((directive_compiler, attribute_value.strip()))
     
             # Create the block corresponding to the current element
@@ -551,38 +799,59 @@ class BaseXMLTemplateCompiler(object):
             else:
                 # It is a non-Genshi element
                 block = self.compile_foreign_element(
-                    element, namespace_map, translatable_element)
+                    element, namespace_map, translatable_element, tag_name)
                 child_namespace_map = None
                 
             # Substitute variables into the enclosed text if any
             if element.text:
                 self.compile_text(lineno, block, element.text, translatable=translatable_element)
-            
-            # Recursively compile child elements
-            for child_element in element.iterchildren():
-                block.append(self.compile_element(child_element, child_namespace_map))
+        
+        return block, genshi_attributes, child_namespace_map
+    
+    def compile_element_end(self, element, block, genshi_attributes):
+        """ Finishes the compilation of a template element
+        
+        element: lxml Element to finish.
+        
+        block: Block returned by compile_element_start with the blocks
+            of all the child elements already appended to it.
+        
+        genshi_attributes: List of Genshi directives returned by
+            compile_element_start, None for non-element nodes.
+        
+        Returns a block representing the compiled element.
+        
+        """
+        blocks_module = self.blocks_module
+        lineno = element.sourceline or 0
+        
+        if genshi_attributes is not None:
             
             # Mark as a compiled element
             block.element = block
             element_block = block
-                
+            
             # Apply the Genshi directives
             for directive_compiler, attribute_value in genshi_attributes:
                 block = directive_compiler(block, element, attribute_value)
                 block.element = element_block
-                
+        
         # Substitute variables into the trailing text if any
         if element.tail:
-            element_block = block
-            block = self.blocks_module.DummyBlock(lineno)
-            block.append(element_block)
+            # NOTE: Comments are already compiled into a dummy block, so
+            #       the tail can be appended to it without wrapping it again.
+            if (genshi_attributes is not None or
+                type(block) is not blocks_module.DummyBlock):
+                element_block = block
+                block = blocks_module.DummyBlock(lineno)
+                block.append(element_block)
             
             # Is the parent element i18n translatable?
             translatable_parent_element = False
             parent_element = element.getparent()
             if parent_element is not None:
-                lc_tagname_with_namespace_prefix = util.namespace_url_to_prefix(
-                    self.namespace_map, parent_element.tag)
+                lc_tagname_with_namespace_prefix = self.get_prefixed_name(
+                    parent_element.tag)
                 translatable_parent_element = (
                     lc_tagname_with_namespace_prefix in self.translatable_element_set)
                 
@@ -590,9 +859,12 @@ class BaseXMLTemplateCompiler(object):
             
         return block
     
-    def compile_foreign_element(self, element, namespace_map, translatable_element=False):
+    def compile_foreign_element(self, element, namespace_map, translatable_element=False, tag_name=None):
         """ Compiles a non-Genshi (foreign) element
         
+        tag_name: Namespace prefixed tag name of the element if it is already
+            known by the caller, it is looked up otherwise.
+        
         Returns a block representing the compiled element.
         
         """
@@ -601,7 +873,8 @@ class BaseXMLTemplateCompiler(object):
         lineno = element.sourceline
 
         # Block representing the element
-        tag_name = util.namespace_url_to_prefix(self.namespace_map, element.tag)
+        if tag_name is None:
+            tag_name = self.get_prefixed_name(element.tag)
         lc_tag_name = tag_name.lower()
         element_block = blocks_module.ElementBlock(lineno, lc_tag_name)
         element_block.element = element_block
@@ -610,38 +883,61 @@ class BaseXMLTemplateCompiler(object):
             element_block.template_line = self.template_lines[lineno]
         
         # Start tag, namespace declarations, attributes from to the template
+        # NOTE: The blocks are collected first, then added to the start tag at once.
         start_tag = blocks_module.OpeningTagBlock(lineno, lc_tag_name)
         element_block.start_tag=start_tag
-        start_tag.append(blocks_module.MarkupBlock(lineno, u'<%s' % tag_name))
+        start_tag_blocks = [self.create_markup_block(lineno, u'<%s' % tag_name)]
         
         # Namespace declarations
         if namespace_map:
-            for namespace_url, namespace_prefix in sorted(namespace_map.items()):
+            if namespace_map is self.namespace_map:
+                namespace_items = self.sorted_namespace_items
+            else:
+                namespace_items = sorted(namespace_map.iteritems())
+            for namespace_url, namespace_prefix in namespace_items:
                 xmlns_attribute_markup = u' xmlns%s="%s"' % (
                     u':%s' % namespace_prefix if namespace_prefix else u'',
                     escape_attribute(namespace_url))
-                start_tag.append(blocks_module.MarkupBlock(lineno, xmlns_attribute_markup))
+                start_tag_blocks.append(self.create_markup_block(lineno, xmlns_attribute_markup))
                 
         # Compile the attributes defined for this element in the XML template
-        for attribute_name, attribute_value in sorted(element.attrib.items()):
+        # NOTE: Attributes are sorted for a deterministic output, but it
+        #       is needed only if there are more than one of them.
+        attribute_items = element.attrib.items()
+        if len(attribute_items) > 1:
+            attribute_items.sort()
+        for attribute_name, attribute_value in attribute_items:
+            
+            attribute_name_with_namespace_prefix = self.get_prefixed_name(
+                attribute_name)
+            
+            # Is this attribute translatable?
+            translatable_attribute = (
+                attribute_name_with_namespace_prefix in self.translatable_attribute_set)
+            
+            # Static attributes are compiled into a single markup block
+            # NOTE: Most of the attributes have no template expressions in
+            #       their values, which can't be written without a $ sign.
+            if not translatable_attribute and '$' not in attribute_value:
+                start_tag_blocks.append(
+                    self.create_markup_block(
+                        lineno,
+                        u' %s="%s"' % (
+                            attribute_name_with_namespace_prefix,
+                            escape_attribute(attribute_value))))
+                continue
             
             # Open the attribute
-            attribute_name_with_namespace_prefix = util.namespace_url_to_prefix(
-                self.namespace_map, attribute_name)
-            start_tag.append(
-                blocks_module.MarkupBlock(
+            start_tag_blocks.append(
+                self.create_markup_block(
                     lineno,
                     u' %s="' % attribute_name_with_namespace_prefix))
             
             # Create block to generate the attribute's value
-            attribute_value_block = self.blocks_module.AttributeValueBlock(
+            attribute_value_block = blocks_module.AttributeValueBlock(
                 lineno, attribute_name_with_namespace_prefix)
             attribute_value_block.element = element_block
             
-            # Is this attribute translatable?
-            translatable_attribute = (
-                attribute_name_with_namespace_prefix in self.translatable_attribute_set)
-            
             # Compile the contents of this attribute
             self.compile_text(
                 lineno, 
@@ -651,56 +947,134 @@ class BaseXMLTemplateCompiler(object):
                 translatable=translatable_attribute)
             
             # Close the attribute
-            start_tag.append(attribute_value_block)
-            start_tag.append(blocks_module.MarkupBlock(lineno, u'"'))
-            
+            start_tag_blocks.append(attribute_value_block)
+            start_tag_blocks.append(self.create_markup_block(lineno, u'"'))
+        
+        start_tag.extend(start_tag_blocks)
+        
         # NOTE: Start tags are closed only later in the postprocessing step.
         
         # End tag
         end_tag = blocks_module.ClosingTagBlock(lineno, lc_tag_name)
         element_block.end_tag = end_tag
-        end_tag.append(blocks_module.MarkupBlock(lineno, u'</%s>' % tag_name))
+        end_tag.append(self.create_markup_block(lineno, u'</%s>' % tag_name))
         
         # NOTE: Short tags are introduced later by the postprocessing step.
         
         return element_block
     
+    def get_prefixed_name(self, name):
+        """ Maps a tag or attribute name from lxml's notation to the
+        namespace prefixed format
+        
+        The results are cached, since the same names are repeated many
+        times in a typical template.
+        
+        """
+        prefixed_name = self.prefixed_name_map.get(name)
+        if prefixed_name is None:
+            prefixed_name = util.namespace_url_to_prefix(self.namespace_map, name)
+            self.prefixed_name_map[name] = prefixed_name
+        return prefixed_name
+    
+    def create_markup_block(self, lineno, markup):
+        """ Creates a block emitting static markup
+        
+        Equal markup strings share a single string instance, since the same
+        tags and attributes are repeated many times in a typical template.
+        The blocks are not shared, since they are modified later.
+        
+        """
+        markup = self.markup_map.setdefault(markup, markup)
+        return self.blocks_module.MarkupBlock(lineno, markup)
+    
+    def get_ascii_expression(self, expression):
+        """ Returns the template expression encoded as an ASCII string
+        
+        The results are cached, since the same expressions (like loop
+        variables) are repeated many times in a typical template.
+        
+        """
+        ascii_expression = self.expression_map.get(expression)
+        if ascii_expression is None:
+            # The expression must be ASCII
+            # FIXME: This limitation should be lifted eventually, since 
+            #        variable names can include non-ASCII characters in Python.
+            #        We enforce this now since the generated source code is ASCII.
+            if isinstance(expression, unicode):
+                ascii_expression = expression.encode('ascii')
+            else:
+                ascii_expression = expression
+            self.expression_map[expression] = ascii_expression
+        return ascii_expression
+    
+    def parse_boolean_expression(self, expression, default=None):
+        """ Parses trivial constant boolean expressions, see
+        util.parse_boolean_expression for the return values
+        
+        The results are cached, since the same conditions are usually
+        repeated many times in a typical template.
+        
+        """
+        key = (expression, default)
+        boolean_expression_map = self.boolean_expression_map
+        if key in boolean_expression_map:
+            return boolean_expression_map[key]
+        
+        value = util.parse_boolean_expression(expression, default)
+        boolean_expression_map[key] = value
+        return value
+    
+    def create_text_expression_block(self, lineno, expression):
+        """ Creates a block emitting the escaped result of a runtime
+        expression, used by the py:replace and py:content directives
+        """
+        # The expression must be ASCII
+        expression = self.get_ascii_expression(expression)
+        
+        text_expression_block = self.blocks_module.TextExpressionBlock(lineno, expression)
+        
+        if constants.GENERATE_DEBUG_COMMENTS:
+            text_expression_block.template_line = self.template_lines[lineno]
+        
+        return text_expression_block
+    
     ### Methods transforming Genshi elements to their attribute variant for uniform processing.
     ### These methods modify the element in place by adding a new attribute.
     
     def translate_py_def(self, element):
         assert 'function' in element.attrib, 'Missing function attribute of element: %s' % element
-        element.attrib['{%s}def' % constants.XML_NAMESPACE_GENSHI] = element.attrib.pop('function')
+        element.attrib[constants.GENSHI_DIRECTIVE_URL_MAP['py:def']] = element.attrib.pop('function')
     
     def translate_py_match(self, element):
         raise NotImplementedError('Found unsupported py:match element at %s#%d!' % (self.template_filename or 'Line ', element.sourceline))
 
     def translate_py_when(self, element):
         assert 'test' in element.attrib, 'Missing test attribute of element: %s' % element
-        element.attrib['{%s}when' % constants.XML_NAMESPACE_GENSHI] = element.attrib.pop('test')
+        element.attrib[constants.GENSHI_DIRECTIVE_URL_MAP['py:when']] = element.attrib.pop('test')
 
     def translate_py_otherwise(self, element):
-        element.attrib['{%s}otherwise' % constants.XML_NAMESPACE_GENSHI] = ''
+        element.attrib[constants.GENSHI_DIRECTIVE_URL_MAP['py:otherwise']] = ''
     
     def translate_py_for(self, element):
         assert 'each' in element.attrib, 'Missing each attribute of element: %s' % element
-        element.attrib['{%s}for' % constants.XML_NAMESPACE_GENSHI] = element.attrib.pop('each')
+        element.attrib[constants.GENSHI_DIRECTIVE_URL_MAP['py:for']] = element.attrib.pop('each')
     
     def translate_py_if(self, element):
         assert 'test' in element.attrib, 'Missing test attribute of element: %s' % element
-        element.attrib['{%s}if' % constants.XML_NAMESPACE_GENSHI] = element.attrib.pop('test')
+        element.attrib[constants.GENSHI_DIRECTIVE_URL_MAP['py:if']] = element.attrib.pop('test')
     
     def translate_py_choose(self, element):
         assert 'test' in element.attrib, 'Missing test attribute of element: %s' % element
-        element.attrib['{%s}choose' % constants.XML_NAMESPACE_GENSHI] = element.attrib.pop('test')
+        element.attrib[constants.GENSHI_DIRECTIVE_URL_MAP['py:choose']] = element.attrib.pop('test')
     
     def translate_py_with(self, element):
         assert 'vars' in element.attrib, 'Missing vars attribute of element: %s' % element
-        element.attrib['{%s}with' % constants.XML_NAMESPACE_GENSHI] = element.attrib.pop('vars')
+        element.attrib[constants.GENSHI_DIRECTIVE_URL_MAP['py:with']] = element.attrib.pop('vars')
         
     def translate_i18n_msg(self, element):
         assert 'params' in element.attrib, 'Missing params attribute of element: %s' % element
-        element.attrib['{%s}msg' % constants.XML_NAMESPACE_I18N] = element.attrib.pop('params')
+        element.attrib[constants.GENSHI_DIRECTIVE_URL_MAP['i18n:msg']] = element.attrib.pop('params')
     
     def translate_i18n_comment(self, element):
         raise NotImplementedError('Found py:comment element at %s#%d, but py:comment is only supported only as an attribute!' % (self.template_filename or 'Line ', element.sourceline))
@@ -709,18 +1083,20 @@ class BaseXMLTemplateCompiler(object):
         # FIXME: I could not find documentation on i18n:domain as an element,
         #        so I had to choose an ad-hoc attribute name here!
         assert 'name' in element.attrib, 'Missing name attribute of element: %s' % element
-        element.attrib['{%s}domain' % constants.XML_NAMESPACE_I18N] = element.attrib.pop('name')
+        element.attrib[constants.GENSHI_DIRECTIVE_URL_MAP['i18n:domain']] = element.attrib.pop('name')
     
     def translate_i18n_choose(self, element):
         assert 'numeral' in element.attrib, 'Missing numeral attribute of element: %s' % element
-        element.attrib['{%s}choose' % constants.XML_NAMESPACE_I18N] = (
-            u'%s; %s' % (element.attrib.pop('numeral'), element.attrib.pop('params', '')))
+        attrib = element.attrib
+        numeral = attrib.pop('numeral')
+        params = attrib.pop('params', '')
+        attrib[constants.GENSHI_DIRECTIVE_URL_MAP['i18n:choose']] = u'; '.join((numeral, params))
         
     def translate_i18n_singular(self, element):
-        element.attrib['{%s}singular' % constants.XML_NAMESPACE_I18N] = ''
+        element.attrib[constants.GENSHI_DIRECTIVE_URL_MAP['i18n:singular']] = ''
     
     def translate_i18n_plural(self, element):
-        element.attrib['{%s}plural' % constants.XML_NAMESPACE_I18N] = ''
+        element.attrib[constants.GENSHI_DIRECTIVE_URL_MAP['i18n:plural']] = ''
     
     def translate_xi_include(self, element):
         raise NotImplementedError('Found unsupported xi:include element at %s#%d' % (self.template_filename or 'Line ', element.sourceline))
@@ -854,7 +1230,7 @@ class BaseXMLTemplateCompiler(object):
         assert attribute_value, 'Empty py:if attribute of element: %s' % element
         
         # Look for a static values
-        attribute_value = util.parse_boolean_expression(attribute_value)
+        attribute_value = self.parse_boolean_expression(attribute_value)
         
         if attribute_value is True:
             # Always True, preserve element
@@ -886,7 +1262,8 @@ class BaseXMLTemplateCompiler(object):
         # We need to push the switch construct below the current element
         element = block.element
         switch_block.extend(element.children)
-        element.children = [switch_block]
+        element.clear()
+        element.append(switch_block)
         
         if constants.GENERATE_DEBUG_COMMENTS:
             switch_block.template_line = self.template_lines[lineno]
@@ -933,49 +1310,25 @@ class BaseXMLTemplateCompiler(object):
         return with_block
             
     def compile_py_replace(self, block, element, attribute_value):
-        lineno = element.sourceline
-        
         # Type hint
         if 0:
             assert isinstance(block, base_blocks.BaseBlock)
             
-        # The expression must be ASCII
-        # FIXME: This limitation should be lifted eventually, since 
-        #        variable names can include non-ASCII characters in Python.
-        #        We enforce this now since the generated source code is ASCII.
-        if isinstance(attribute_value, unicode):
-            attribute_value = attribute_value.encode('ascii')
-        
         # Replace the element with the result of the given runtime expression
-        replace_block = self.blocks_module.TextExpressionBlock(lineno, attribute_value)
-        
-        if constants.GENERATE_DEBUG_COMMENTS:
-            replace_block.template_line = self.template_lines[lineno]
-        
-        return replace_block
+        return self.create_text_expression_block(
+            element.sourceline, attribute_value)
         
     def compile_py_content(self, block, element, attribute_value):
-        lineno = element.sourceline
-        
         # Type hint
         if 0:
             assert isinstance(block, base_blocks.BaseBlock)
             
-        # The expression must be ASCII
-        # FIXME: This limitation should be lifted eventually, since 
-        #        variable names can include non-ASCII characters in Python.
-        #        We enforce this now since the generated source code is ASCII.
-        if isinstance(attribute_value, unicode):
-            attribute_value = attribute_value.encode('ascii')
-        
         # Replace children with the result of the given runtime expression
-        content_block = self.blocks_module.TextExpressionBlock(lineno, attribute_value)
+        content_block = self.create_text_expression_block(
+            element.sourceline, attribute_value)
         block.clear()
         block.append(content_block)
         
-        if constants.GENERATE_DEBUG_COMMENTS:
-            content_block.template_line = self.template_lines[lineno]
-        
         return block
 
     def compile_py_attrs(self, block, element, attribute_value):
@@ -1016,7 +1369,7 @@ class BaseXMLTemplateCompiler(object):
         assert isinstance(element_block, base_blocks.ElementBlock), 'No element this py:strip is applying to!'
         
         # Look for a static values
-        attribute_value = util.parse_boolean_expression(attribute_value, default=True)
+        attribute_value = self.parse_boolean_expression(attribute_value, default=True)
         
         if attribute_value is True:
             # Always True, remove the opening and end tags
@@ -1046,12 +1399,17 @@ class BaseXMLTemplateCompiler(object):
         lineno = element.sourceline
         
         # Split the parameter list and check for no parameters
-        if attribute_value.strip():
-            parameter_name_list = [
-                name.strip() for name in attribute_value.split(',')]
+        # NOTE: Most of the messages have a single parameter at most.
+        attribute_value = attribute_value.strip()
+        if attribute_value:
+            if ',' in attribute_value:
+                parameter_name_list = [
+                    name.strip() for name in attribute_value.split(',')]
+            else:
+                parameter_name_list = [attribute_value]
         else:
             # No parameters defined
-            if element.tag.lower() == '{%s}msg' % constants.XML_NAMESPACE_I18N:
+            if element.tag.lower() == constants.GENSHI_DIRECTIVE_URL_MAP['i18n:msg']:
                 # It should result in no output for compatibility with Genshi's
                 # behavior. Otherwise it would be logical to just output its
                 # translated text contents.
@@ -1066,13 +1424,13 @@ class BaseXMLTemplateCompiler(object):
             if not util.is_identifier(parameter_name):
                 raise ValueError(
                     'Invalid i18n:msg parameter on line #%d (not a valid identifier): %s' % 
-                    (element.sourceline, parameter_name))
+                    (lineno, parameter_name))
             
         # There must be no duplicate parameter names
         if len(set(parameter_name_list)) != len(parameter_name_list):
             raise ValueError(
                 'Duplicate i18n:msg parameter name on line #%d: %s' % 
-                (element.sourceline, attribute_value))
+                (lineno, attribute_value))
         
         # Construct translatable template
         
@@ -1091,26 +1449,15 @@ class BaseXMLTemplateCompiler(object):
         if not string_template:
             raise ValueError('Empty i18n:msg block on line #%d!' % block.lineno)
         
-        # Translate the string template at compile time, it consists of the
-        # hierarchy of translatable text, plus the element and expression
-        # markers. The translation can change the position of expressions,
-        # but can't change the hierarchy of elements.
-        if self.translator:
-            translated_string_template = self.translator_ugettext(string_template)
-        else:
-            translated_string_template = string_template
-        
-        # Replace the element markers in the string template with more usable ones
-        while 1:
-            translated_string_template, count = constants.RX_I18N_MSG_ELEMENT.subn(ur'%(start:\1)s\2%(end:\1)s', translated_string_template)
-            if not count:
-                break
+        # Translate and split the string template
+        translated_string_template, string_template_item_list = (
+            self.get_i18n_msg_template_items(string_template))
             
         # Construct output based on the translated string template
-        string_template_item_list = constants.RX_I18N_MSG_TEMPLATE_ITEM.split(translated_string_template)
-        string_template_item_iter = iter(string_template_item_list)
-        block_list = [blocks_module.TextBlock(lineno, string_template_item_iter.next())]
-        for item_identifier, text_fragment in itertools.izip(string_template_item_iter, string_template_item_iter):
+        block_list = [blocks_module.TextBlock(lineno, string_template_item_list[0])]
+        for i in xrange(1, len(string_template_item_list), 2):
+            item_identifier = string_template_item_list[i]
+            text_fragment = string_template_item_list[i + 1]
             if ':' in item_identifier:
                 element_number = int(item_identifier.split(':')[1])
                 element_block = element_map.get(element_number)
@@ -1158,6 +1505,42 @@ class BaseXMLTemplateCompiler(object):
         
         return block
     
+    def get_i18n_msg_template_items(self, string_template):
+        """ Translates an i18n:msg string template and splits it to items
+        
+        Returns the translated string template and the list of its text
+        fragments alternating with the identifiers of the elements and
+        parameters in it.
+        
+        The results are cached, since they depend only on the string template
+        and the same messages are often repeated in a typical template. The
+        blocks built from the items can't be cached, since they include the
+        element and expression blocks of each i18n:msg directive.
+        
+        """
+        cached_items = self.i18n_msg_template_map.get(string_template)
+        if cached_items is not None:
+            return cached_items
+        
+        # Translate the string template at compile time, it consists of the
+        # hierarchy of translatable text, plus the element and expression
+        # markers. The translation can change the position of expressions,
+        # but can't change the hierarchy of elements.
+        if self.translator:
+            translated_string_template = self.translator_ugettext(string_template)
+        else:
+            translated_string_template = string_template
+        
+        # Replace the element markers in the string template with more usable ones
+        translated_string_template = util.replace_i18n_msg_elements(
+            translated_string_template)
+        
+        string_template_item_list = constants.RX_I18N_MSG_TEMPLATE_ITEM.split(translated_string_template)
+        
+        cached_items = (translated_string_template, string_template_item_list)
+        self.i18n_msg_template_map[string_template] = cached_items
+        return cached_items
+    
     def transform_i18n_msg_block(self, block, iter_element_numbers, iter_parameters, element_map, parameter_map):
         """ Transforms a block to be usable in the subtree of an i18n:msg block
         """
@@ -1165,7 +1548,9 @@ class BaseXMLTemplateCompiler(object):
         if 0:
             assert isinstance(block, base_blocks.BaseBlock)
         
-        if 'parameter_name' in block.__slots__:
+        slot_names = block.get_slot_names()
+        
+        if 'parameter_name' in slot_names:
             # Assign parameter names to template expressions
             try:
                 block.parameter_name = iter_parameters.next()
@@ -1175,7 +1560,7 @@ class BaseXMLTemplateCompiler(object):
                     'inside i18n:msg element at line #%d!' % block.lineno)
             parameter_map[block.parameter_name] = block
         
-        elif 'element_number' in block.__slots__:
+        elif 'element_number' in slot_names:
             # Assign integer serial numbers to the elements
             block.element_number = iter_element_numbers.next()
             element_map[block.element_number] = block
@@ -1211,9 +1596,19 @@ class BaseXMLTemplateCompiler(object):
 
         # Function to append a fragment to the output, determines runtime escaping
         if attribute:
-            block_class = self.blocks_module.AttributeValueFragmentBlock
+            block_class = blocks_module.AttributeValueFragmentBlock
         else:
-            block_class = self.blocks_module.TextBlock
+            block_class = blocks_module.TextBlock
+        
+        # Template expressions can't be written without a $ sign, so most of
+        # the text is appended as a single fragment without splitting it
+        if '$' not in text:
+            if translatable and text.strip():
+                text = self.translate_text(text)
+            fragment_block = block_class(lineno, text)
+            fragment_block.attribute = attribute
+            block.append(fragment_block)
+            return block
         
         # Find all template expressions
         fragment_list = constants.RX_TEMPLATE_EXPRESSION.split(text)
@@ -1223,10 +1618,7 @@ class BaseXMLTemplateCompiler(object):
         first_fragment = fragment_list[0]
         if first_fragment:
             if translatable and first_fragment.strip():
-                # Translate text at compile time, but only without the surrounding whitespace
-                left_whitespace, stripped_text, right_whitespace = util.separate_whitespace(first_fragment)
-                stripped_text = self.translator_ugettext(stripped_text)
-                first_fragment = left_whitespace + stripped_text + right_whitespace
+                first_fragment = self.translate_text(first_fragment)
             fragment_block = block_class(lineno, first_fragment)
             fragment_block.attribute = attribute
             block.append(fragment_block)
@@ -1243,14 +1635,27 @@ class BaseXMLTemplateCompiler(object):
                 
             if fragment:
                 if translatable and fragment.strip():
-                    # Translate text at compile time, but only without the surrounding whitespace
-                    left_whitespace, stripped_text, right_whitespace = util.separate_whitespace(fragment)
-                    stripped_text = self.translator_ugettext(stripped_text)
-                    fragment = left_whitespace + stripped_text + right_whitespace
+                    fragment = self.translate_text(fragment)
                 fragment_block = block_class(lineno, fragment)
                 fragment_block.attribute = attribute
                 block.append(fragment_block)
     
+    def translate_text(self, text):
+        """ Translates a text fragment at compile time, but only without
+        the surrounding whitespace
+        
+        The results are cached, since the same short texts (like labels
+        and table headers) are often repeated in a typical template.
+        
+        """
+        translated_text = self.translation_map.get(text)
+        if translated_text is None:
+            left_whitespace, stripped_text, right_whitespace = util.separate_whitespace(text)
+            stripped_text = self.translator_ugettext(stripped_text)
+            translated_text = left_whitespace + stripped_text + right_whitespace
+            self.translation_map[text] = translated_text
+        return translated_text
+    
     def compile_template_expression(self, lineno, expression, attribute=None):
         """ Compiles a single template expression outputting text or HTML
 
@@ -1265,25 +1670,22 @@ class BaseXMLTemplateCompiler(object):
         Returns the resulting code block.
         
         """
+        blocks_module = self.blocks_module
         expression = expression.strip()
         assert expression, 'Empty template expression'
         
         # The expression must be ASCII
-        # FIXME: This limitation should be lifted eventually, since 
-        #        variable names can include non-ASCII characters in Python.
-        #        We enforce this now since the generated source code is ASCII.
-        if isinstance(expression, unicode):
-            expression = expression.encode('ascii')
+        expression = self.get_ascii_expression(expression)
         
         # NOTE: Markup() expressions will be translated to
         #       MarkupExpressionBlock by the postprocessor.
         if expression == '$':
-            block = self.blocks_module.TextBlock(lineno, '$')
+            block = blocks_module.TextBlock(lineno, '$')
         elif attribute:
-            block = self.blocks_module.AttributeExpressionBlock(lineno, expression)
+            block = blocks_module.AttributeExpressionBlock(lineno, expression)
             block.attribute = attribute
         else:
-            block = self.blocks_module.TextExpressionBlock(lineno, expression)
+            block = blocks_module.TextExpressionBlock(lineno, expression)
 
         if constants.GENERATE_DEBUG_COMMENTS:
             block.template_line = self.template_lines[lineno]
@@ -1300,6 +1702,11 @@ class BaseXMLTemplateCompiler(object):
         """
         if constants.DETECT_RECURSION:
             assert not block.contains(self)
+        
+        # Static markup and text blocks are the most common ones, they have
+        # no children and none of the postprocessing steps apply to them
+        if isinstance(block, base_blocks.InvariantBlock):
+            return [block]
             
         # Pass the enclosing py:switch directive down in the hierarchy
         if isinstance(block, base_blocks.SwitchBlock):
@@ -1323,19 +1730,33 @@ class BaseXMLTemplateCompiler(object):
             block.prepared = True
         
         # Do not escape the output of template functions defined in this template
+        # NOTE: Literal expressions are folded into literal blocks, so their
+        #       whitespace is kept as is by the optimizer.
         if isinstance(block, base_blocks.TextExpressionBlock):
             
+            expression_block = block
             expression = block.data.strip()
             
             if expression.endswith(')'):
                 
-                function_name = expression.split('(', 1)[0].strip()
+                function_call_match = constants.RX_FUNCTION_CALL.match(expression)
+                function_name = function_call_match and function_call_match.group(1)
                 
                 if function_name == 'Markup':
-                    block = self.blocks_module.MarkupExpressionBlock(
-                        block.lineno, expression[7: -1].strip())
-                
-                if function_name in self.function_map:
+                    # The argument is between the parenthesis following the
+                    # function name, which might be separated by whitespace
+                    argument_index = expression.index('(', function_call_match.end(1)) + 1
+                    markup_expression = expression[argument_index: -1].strip()
+                    markup = util.evaluate_literal_text(markup_expression)
+                    if markup is None:
+                        block = self.blocks_module.MarkupExpressionBlock(
+                            block.lineno, markup_expression)
+                    else:
+                        # Constant markup, no need to evaluate it at runtime
+                        block = self.blocks_module.LiteralMarkupBlock(
+                            block.lineno, markup)
+                    
+                elif function_name in self.function_map:
                     block = self.blocks_module.MarkupExpressionBlock(
                         block.lineno, expression)
                     
@@ -1343,6 +1764,27 @@ class BaseXMLTemplateCompiler(object):
                 # Genshi converts None valued expressions to empty output
                 return []
             
+            else:
+                # Constant text is escaped at compile time
+                text = util.evaluate_literal_text(expression)
+                if text is not None:
+                    block = self.blocks_module.LiteralTextBlock(block.lineno, text)
+            
+            if constants.GENERATE_DEBUG_COMMENTS:
+                block.template_line = expression_block.template_line
+            
+        # Constant attribute values are also escaped at compile time
+        if isinstance(block, base_blocks.AttributeExpressionBlock):
+            
+            text = util.evaluate_literal_text(block.data.strip())
+            if text is not None:
+                fragment_block = self.blocks_module.LiteralAttributeValueFragmentBlock(
+                    block.lineno, text)
+                fragment_block.attribute = block.attribute
+                if constants.GENERATE_DEBUG_COMMENTS:
+                    fragment_block.template_line = block.template_line
+                block = fragment_block
+            
         # Finalize elements
         if isinstance(block, base_blocks.ElementBlock):
             
@@ -1353,7 +1795,7 @@ class BaseXMLTemplateCompiler(object):
                 # have a short form.
                 # See also: http://www.w3.org/TR/xhtml1/#guidelines
                 if (block.children or
-                    (self.output_standard == 'xhtml' and 
+                    (self.xhtml_output and 
                      ':' not in block.data and
                      block.data not in constants.SHORT_HTML_ELEMENTS_SET)):
                     
@@ -1377,8 +1819,6 @@ class BaseXMLTemplateCompiler(object):
         Returns the list of replacement blocks.
         
         """
-        blocks_module = self.blocks_module
-        
         # Clear parent references to break reference loops
         # NOTE: Such references can only be used by the compilation and
         #       postprocessing phases, they must not be used by the
@@ -1390,122 +1830,77 @@ class BaseXMLTemplateCompiler(object):
         # Optimize all the child blocks first
         block.apply_transformation(self.optimize)
         
-        # Extract leading and trailing invariant markup whenever possible
-        if (isinstance(block, (base_blocks.WithBlock, blocks_module.AttributeValueBlock)) and
-            (block.children and
-            (block.children[0].is_invariant() or
-             block.children[-1].is_invariant()))):
+        return self.optimize_block(block)
+    
+    def optimize_block(self, block):
+        """ Optimizes a single block, its children must be optimized already
         
-            leading_invariant_blocks = []
-            while block.children and block.children[0].is_invariant():
-                leading_invariant_blocks.append(block.children.pop(0))
-                
-            trailing_invariant_blocks = []
-            while block.children and block.children[-1].is_invariant():
-                trailing_invariant_blocks.insert(0, block.children.pop(-1))
-
-            block = blocks_module.DummyBlock(
-                block.lineno,
-                children=(
-                    leading_invariant_blocks +
-                    ([] if block.is_empty() else [block]) +
-                    trailing_invariant_blocks))
-
-            # Optimize the newly added block
-            block.apply_transformation(self.optimize)
+        Returns the list of replacement blocks.
         
-        # Collide nested py:with directives (single child only)
-        if (isinstance(block, base_blocks.WithBlock) and
-            len(block.children) == 1 and
-            isinstance(block.children[0], base_blocks.WithBlock)):
+        """
+        blocks_module = self.blocks_module
         
-            block.data = '%s; %s' % (block.data.rstrip(';'), block.children[0].data)
-            block.children = block.children[0].children
+        # Block class specific optimizations
+        # NOTE: The exact class of the block is looked up, so no chain of
+        #       isinstance checks is needed for the most common blocks.
+        block_optimizer = self.block_optimizer_map.get(type(block))
+        if block_optimizer is not None:
+            block = block_optimizer(block)
         
-        # Foreign element optimizations
-        if isinstance(block, base_blocks.ElementBlock):
-            
-            # Put the start and end tags into the list of children
-            # blocks if the tags cannot be stripped out. It allows for
-            # colliding the tags with the tail and head of static contents.
-            if block.strip_expression is None:
-
-                # Inline the start tag
-                if block.start_tag:
-                    if constants.GENERATE_DEBUG_COMMENTS:
-                        block.template_line = (
-                            (block.start_tag.template_line or '') +
-                            block.template_line)
-                    block.children[0:0] = block.start_tag.children
-                    block.start_tag = None
-                    
-                # Inline the end tag
-                if block.end_tag:
-                    if constants.GENERATE_DEBUG_COMMENTS:
-                        block.template_line += (block.end_tag.template_line or '')
-                    block.children.extend(block.end_tag.children)
-                    block.end_tag = None
-                    
-                # Remove the ElementBlock container,
-                # it allows for colliding it with the surrounding markup
-                element_block = block
-                block = base_blocks.DummyBlock(
-                    element_block.lineno,
-                    children=element_block.children)
-                
-                if constants.GENERATE_DEBUG_COMMENTS:
-                    block.template_line = element_block.template_line
-                
-                # Optimize the newly added block
-                block.apply_transformation(self.optimize)
-                
         # Concatenate subsequent child blocks emitting static markup
+        # NOTE: It is done in a single forward pass collecting each run of
+        #       invariant blocks, then joining them at once. The None at
+        #       the end flushes the last run.
         children = block.children
         if len(children) > 1:
             
-            for index in xrange(len(children) - 1, 0, -1):
+            InvariantBlock = base_blocks.InvariantBlock
+            LiteralBlock = base_blocks.LiteralBlock
+            concatenated_children = []
+            invariant_blocks = []
+            for child in itertools.chain(children, (None, )):
                 
-                first_block = children[index - 1]
-                second_block = children[index]
+                if isinstance(child, InvariantBlock):
+                    invariant_blocks.append(child)
+                    continue
                 
-                if (isinstance(first_block, base_blocks.InvariantBlock) and
-                    isinstance(second_block, base_blocks.InvariantBlock)):
-                    
-                    concatenated_markup = (
-                        first_block.get_markup() + second_block.get_markup())
+                if len(invariant_blocks) > 1:
                     
-                    concatenated_block = self.blocks_module.MarkupBlock(
-                        lineno=first_block.lineno,
-                        data=concatenated_markup)
+                    for invariant_block in invariant_blocks:
+                        if isinstance(invariant_block, LiteralBlock):
+                            # The concatenated block is also literal, so its
+                            # whitespace won't be reduced by any later pass
+                            concatenated_block = blocks_module.LiteralMarkupBlock(
+                                lineno=invariant_blocks[0].lineno,
+                                data=self.concatenate_literal_markup(invariant_blocks))
+                            break
+                    else:
+                        concatenated_markup = ''.join(
+                            invariant_block.get_markup()
+                            for invariant_block in invariant_blocks)
+                        
+                        concatenated_block = blocks_module.MarkupBlock(
+                            lineno=invariant_blocks[0].lineno,
+                            data=concatenated_markup)
+                        
+                        self.reduce_block_whitespace(concatenated_block)
                     
                     if constants.GENERATE_DEBUG_COMMENTS:
-                        concatenated_block.template_line = (
-                            (first_block.template_line or '') + 
-                            (second_block.template_line or ''))
-                        
-                    children[index - 1] = concatenated_block
-                    del children[index]
+                        concatenated_block.template_line = ''.join(
+                            invariant_block.template_line or ''
+                            for invariant_block in invariant_blocks)
                     
-        # Static markup and text content optimizations,
-        # these do not affect attribute values
-        if isinstance(block, (base_blocks.MarkupBlock, base_blocks.TextBlock)):
-            
-            # Redundant whitespace elimination (HTML minimizer)
-            if self.reduce_whitespace and block.data:
+                    concatenated_children.append(concatenated_block)
+                else:
+                    concatenated_children.extend(invariant_blocks)
                 
-                if block.data.strip():
-                    # Reduce the heading and trailing whitespace
-                    heading_whitespace, text, trailing_whitespace = (
-                        constants.RX_WHITESPACE_HEAD_TAIL.match(block.data).groups())
-                    block.data = (
-                        util.reduce_whitespace(heading_whitespace) +
-                        text +
-                        util.reduce_whitespace(trailing_whitespace))
+                del invariant_blocks[:]
+                
+                if child is not None:
+                    concatenated_children.append(child)
+                
+            block.children = concatenated_children
                     
-                else:
-                    # Reduce whitespace markup
-                    block.data = util.reduce_whitespace(block.data)
-        
         # Remove unnecessary level of block nesting
         if isinstance(block, base_blocks.DummyBlock):
             return block.children
@@ -1514,8 +1909,176 @@ class BaseXMLTemplateCompiler(object):
         if block.is_empty():
             return []
         
+        # The children are not modified after the optimization, only
+        # formatted, so they are stored as a tuple to save memory
+        block.children = tuple(block.children)
+        
         return [block]
     
+    def extract_invariant_blocks(self, block):
+        """ Extracts the leading and trailing invariant markup whenever
+        possible, returns the replacement block
+        """
+        # NOTE: The invariant children are counted from both ends first, so
+        #       each child is checked only once and the list is sliced only
+        #       once instead of popping the blocks one by one from its head.
+        children = block.children
+        children_count = len(children)
+        
+        leading_count = 0
+        while (leading_count < children_count and
+               children[leading_count].is_invariant()):
+            leading_count += 1
+        
+        trailing_index = children_count
+        while (trailing_index > leading_count and
+               children[trailing_index - 1].is_invariant()):
+            trailing_index -= 1
+        
+        if leading_count or trailing_index < children_count:
+            
+            # NOTE: The children are a tuple if the block has already been
+            #       optimized, so the slices are converted to lists.
+            leading_invariant_blocks = list(children[:leading_count])
+            trailing_invariant_blocks = list(children[trailing_index:])
+            block.children = list(children[leading_count:trailing_index])
+            
+            block = self.blocks_module.DummyBlock(
+                block.lineno,
+                children=(
+                    leading_invariant_blocks +
+                    ([] if block.is_empty() else [block]) +
+                    trailing_invariant_blocks))
+            
+            # Optimize the newly added block, the children of the
+            # extracted blocks are already optimized
+            block.apply_transformation(self.optimize_block)
+            
+        return block
+    
+    def optimize_with_block(self, block):
+        """ Optimizes a py:with block, returns the replacement block
+        """
+        block = self.extract_invariant_blocks(block)
+        
+        # Collide nested py:with directives (single child only)
+        if (isinstance(block, base_blocks.WithBlock) and
+            len(block.children) == 1 and
+            isinstance(block.children[0], base_blocks.WithBlock)):
+        
+            block.data = '%s; %s' % (block.data.rstrip(';'), block.children[0].data)
+            block.children = block.children[0].children
+        
+        return block
+    
+    def optimize_element_block(self, block):
+        """ Foreign element optimizations, returns the replacement block
+        """
+        # Put the start and end tags into the list of children
+        # blocks if the tags cannot be stripped out. It allows for
+        # colliding the tags with the tail and head of static contents.
+        if block.strip_expression is not None:
+            return block
+        
+        # The children and the tags are already optimized, so only the
+        # single block optimizations are applied on them once more.
+        # NOTE: ElementBlock.apply_transformation also transforms the
+        #       start and end tags, the blocks below them are not
+        #       visited again.
+        block.apply_transformation(self.optimize_block)
+        
+        # Inline the tags into a new list of children, it avoids shifting
+        # all the children of the element to insert the start tag
+        children = []
+        
+        # Inline the start tag
+        if block.start_tag:
+            if constants.GENERATE_DEBUG_COMMENTS:
+                block.template_line = (
+                    (block.start_tag.template_line or '') +
+                    block.template_line)
+            children.extend(block.start_tag.children)
+            block.start_tag = None
+        
+        children.extend(block.children)
+            
+        # Inline the end tag
+        if block.end_tag:
+            if constants.GENERATE_DEBUG_COMMENTS:
+                block.template_line += (block.end_tag.template_line or '')
+            children.extend(block.end_tag.children)
+            block.end_tag = None
+            
+        # Remove the ElementBlock container,
+        # it allows for colliding it with the surrounding markup
+        element_block = block
+        block = base_blocks.DummyBlock(
+            element_block.lineno,
+            children=children)
+        
+        if constants.GENERATE_DEBUG_COMMENTS:
+            block.template_line = element_block.template_line
+        
+        return block
+    
+    def reduce_block_whitespace(self, block):
+        """ Reduces the heading and trailing whitespace of a markup or
+        text block if enabled by the reduce_whitespace option,
+        returns the block
+        """
+        # Redundant whitespace elimination (HTML minimizer)
+        if self.reduce_whitespace and block.data:
+            block.data = self.reduce_data_whitespace(block.data)
+                
+        return block
+    
+    def reduce_data_whitespace(self, data):
+        """ Reduces the heading and trailing whitespace of markup or text,
+        returns the reduced data
+        """
+        if data.strip():
+            # Reduce the heading and trailing whitespace
+            heading_whitespace, text, trailing_whitespace = (
+                util.separate_whitespace(data))
+            return (
+                util.reduce_whitespace(heading_whitespace) +
+                text +
+                util.reduce_whitespace(trailing_whitespace))
+            
+        # Reduce whitespace markup
+        return util.reduce_whitespace(data)
+    
+    def concatenate_literal_markup(self, invariant_blocks):
+        """ Concatenates the markup of invariant blocks including literal
+        ones, returns the concatenated markup
+        
+        The whitespace is reduced only in each run of the non-literal blocks
+        if enabled by the reduce_whitespace option, the markup of the literal
+        blocks is kept as is. The None at the end flushes the last run.
+        
+        """
+        LiteralBlock = base_blocks.LiteralBlock
+        markup_list = []
+        reducible_markup_list = []
+        for invariant_block in itertools.chain(invariant_blocks, (None, )):
+            
+            if (invariant_block is not None and
+                not isinstance(invariant_block, LiteralBlock)):
+                reducible_markup_list.append(invariant_block.get_markup())
+                continue
+            
+            if reducible_markup_list:
+                reducible_markup = ''.join(reducible_markup_list)
+                if self.reduce_whitespace and reducible_markup:
+                    reducible_markup = self.reduce_data_whitespace(reducible_markup)
+                markup_list.append(reducible_markup)
+                del reducible_markup_list[:]
+            
+            if invariant_block is not None:
+                markup_list.append(invariant_block.get_markup())
+        
+        return ''.join(markup_list)
+    
     ### Debugging
     
     def dump_block_tree(self, block, output, description):
@@ -1526,8 +2089,8 @@ class BaseXMLTemplateCompiler(object):
         
         block: Block to dump.
         
-        output: File object, file name or any other object with a true
-            truth value to dump the block to stdout.
+        output: File-like object with a write method, file name or any
+            other object with a true truth value to dump the block to stdout.
             
         description: Description to print to stdout before dumping there.
         
@@ -1537,8 +2100,9 @@ class BaseXMLTemplateCompiler(object):
         
         dump = block.pretty_format()
         
-        if isinstance(output, file):
-            output.write(dump)
+        write = getattr(output, 'write', None)
+        if write is not None:
+            write(dump)
             
         elif isinstance(output, basestring):
             with open(output, 'wt') as output_file:
@@ -1549,3 +2113,26 @@ class BaseXMLTemplateCompiler(object):
             print
             print dump
             print
+
+    def print_block_tree_difference(self, before_dump, block, description, before_label, after_label):
+        """ Prints the difference between a former dump of the block tree
+        and its current state
+        
+        before_dump: Pretty formatted dump of the block tree taken earlier.
+        
+        block: Block to compare with the former dump.
+        
+        description: Description to print before the difference.
+        
+        before_label, after_label: Labels of the unified diff.
+        
+        """
+        after_dump = block.pretty_format()
+        
+        print description
+        print
+        if before_dump == after_dump:
+            print 'No difference.'
+        else:
+            util.print_diff(before_dump, after_dump, before_label, after_label)
+        print
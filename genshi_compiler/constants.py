@@ -34,26 +34,40 @@ PRINT_POSTPROCESSING_DIFFERENCE = DEBUGGING and False
 PRINT_OPTIMIZATION_DIFFERENCE = DEBUGGING and False
 
 # Matches strings suitable as Python identifiers
-RX_IDENTIFIER = re.compile(r'^[a-z_]\w*$', re.I)
+# NOTE: \Z is used instead of $, since $ also matches before a trailing newline.
+RX_IDENTIFIER = re.compile(r'[a-z_]\w*\Z', re.I)
+
+# Maps the lower case constant boolean expressions to their truth value
+BOOLEAN_CONSTANT_MAP = {
+    'true': True,
+    'false': False,
+    }
 
 # Regexp to split text containing template variable references
 RX_TEMPLATE_EXPRESSION = re.compile(
     r'\$(?:(\$)|\{(.*?)\}|([a-z_]\w*(?:\.[a-z_]\w*)*))', re.I)
 
-# Regexp to find duplicate whitespace and newline characters
-RX_DUPLICATE_WHITESPACE = re.compile(r'(\s\s+)', re.DOTALL)
+# Matches stripped expressions ending with a function call, like f(x),
+# the first group is the name of the function
+RX_FUNCTION_CALL = re.compile(r'^([^(]*?)\s*\(.*\)$', re.DOTALL)
+
+# Matches the start of expressions which might be string or number literals,
+# it is used to avoid parsing most of the expressions, like variable references
+RX_LITERAL_START = re.compile(r'[-.\d]|[ubr]{0,2}[\'"]', re.I)
 
-# Regexp to count whitespace at the beginning
-RX_LEFT_WHITESPACE = re.compile(r'^(\s*).*$', re.DOTALL)
+# Regexp to find whitespace runs containing at least one newline
+RX_NEWLINE_WHITESPACE = re.compile(r'[ \t\r\f\v]*\n[ \t\n\r\f\v]*')
 
-# Regexp to separate the lading and trailing whitespace if any
-RX_LEFT_RIGHT_WHITESPACE = re.compile(r'^(\s*)(.*?)(\s*)$', re.DOTALL)
+# Regexp to find duplicate whitespace without newline characters
+RX_DUPLICATE_BLANKS = re.compile(r'[ \t\r\f\v]{2,}')
 
-# Split a text to heading whitespace, text and trailing whitespace
-RX_WHITESPACE_HEAD_TAIL = re.compile(r'^(\s*)(.*?)(\s*)$', re.DOTALL)
+# Whitespace characters matched by \s in the regular expressions
+# NOTE: Unicode whitespace like the non-breaking space is not included.
+WHITESPACE_CHARACTERS = ' \t\n\r\f\v'
 
-# Regular expression to match the element template in i18n:msg translations
-RX_I18N_MSG_ELEMENT = re.compile(ur'\[(\d+):(.*?)\]')
+# Regular expression to match the start and end of the element templates
+# in i18n:msg translations, like [1:...]
+RX_I18N_MSG_ELEMENT = re.compile(ur'\[(\d+):|\]')
 
 # Regular expression to split the translated i18n:msg template at compile time
 RX_I18N_MSG_TEMPLATE_ITEM = re.compile(ur'%\(([a-z_0-9:]+)\)s', re.I)
@@ -135,6 +149,17 @@ GENSHI_ELEMENTS_WITH_URL = tuple(
 
 GENSHI_ATTRIBUTES_WITH_URL = tuple(
     itertools.imap(xml_namespace_prefix_to_url, GENSHI_ATTRIBUTES))
+GENSHI_ATTRIBUTES_WITH_URL_SET = frozenset(GENSHI_ATTRIBUTES_WITH_URL)
+
+# Maps Genshi attributes with full URL prefixes to their processing order
+GENSHI_ATTRIBUTE_ORDER_MAP = dict(
+    (name, index) for index, name in enumerate(GENSHI_ATTRIBUTES_WITH_URL))
+
+# Maps Genshi directive names with the usual prefixes to their lxml notation,
+# so the names don't need to be formatted while compiling templates
+GENSHI_DIRECTIVE_URL_MAP = dict(
+    (name, xml_namespace_prefix_to_url(name))
+    for name in GENSHI_ELEMENTS + GENSHI_ATTRIBUTES)
 
 del xml_namespace_prefix_to_url
 
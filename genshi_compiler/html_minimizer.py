@@ -25,12 +25,19 @@ def minimize_text(text):
     if not text:
         return text
     
-    if text.strip():
-        if text != text.lstrip():
-            text = ' ' + text.lstrip()
-        if text != text.rstrip():
-            text = text.rstrip() + ' '
+    # Most of the text has no heading or trailing whitespace at all
+    heading_whitespace = text[0].isspace()
+    trailing_whitespace = text[-1].isspace()
+    if not (heading_whitespace or trailing_whitespace):
         return text
+    
+    stripped_text = text.strip()
+    if stripped_text:
+        if heading_whitespace:
+            stripped_text = ' ' + stripped_text
+        if trailing_whitespace:
+            stripped_text += ' '
+        return stripped_text
             
     if '\n' in text:
         return '\n'
@@ -38,10 +45,11 @@ def minimize_text(text):
     return ' '
 
 def minimize_element(element):
-    element.text = minimize_text(element.text)
-    element.tail = minimize_text(element.tail)
-    for child in element.getchildren():
-        minimize_element(child)
+    # NOTE: Walking the subtree by lxml's iterator, which is implemented in C,
+    #       instead of Python level recursion over the list of children.
+    for node in element.iter():
+        node.text = minimize_text(node.text)
+        node.tail = minimize_text(node.tail)
 
 def minimize(html):
     """ Minimizes HTML by reducing all duplicate whitespace and newlines
@@ -52,7 +60,16 @@ def minimize(html):
     sections are kept intact.
     
     """
-    tree = etree.fromstring(constants.DOCTYPE_AND_HTML_ENTITIES + html)
+    # NOTE: The entity definitions are fed to the parser before the markup
+    #       instead of concatenating them with the markup on each call. The
+    #       parser fixes the type of its input by the first chunk fed, so
+    #       unicode markup is encoded to the same UTF-8 as the ASCII DTD.
+    if isinstance(html, unicode):
+        html = html.encode('utf-8')
+    parser = etree.XMLParser(encoding='utf-8')
+    parser.feed(constants.DOCTYPE_AND_HTML_ENTITIES)
+    parser.feed(html)
+    tree = parser.close()
     minimize_element(tree)
     tree.tail = ''
     html = etree.tostring(tree)
@@ -11,12 +11,18 @@ import itertools
 import constants, util, base_blocks
 
 
+# Return the next serial number of the generated switch variables, py:with
+# functions and py:strip variables, the numbers are unique in the process
+next_switch_index = itertools.count().next
+next_with_index = itertools.count().next
+next_keep_index = itertools.count().next
+
 ### Control constructs
 
 DummyBlock = base_blocks.DummyBlock
 
 class ModuleBlock(base_blocks.ModuleBlock):
-    __slots__ = base_blocks.ModuleBlock.__slots__
+    __slots__ = ()
     
     # Header of the generated Python modules
     header_template = '''\
@@ -40,37 +46,50 @@ import xml.sax.saxutils
 
 
 # Converts any object to unicode
-_x_to_text = unicode
+_x_convert_to_text = unicode
 
 # XML escaping text
-_x_escape_text = xml.sax.saxutils.escape
+_x_xml_escape_text = xml.sax.saxutils.escape
 
-def _x_escape_attribute(value, quoteattr=xml.sax.saxutils.quoteattr):
-    """ Escapes an XML attribute value
+def _x_xml_escape_attribute(value):
+    """ Escapes an XML attribute value to be used inside double quotes
     """
-    return quoteattr("'" + value)[2: -1]
+    return (
+        value
+        .replace('&', '&amp;')
+        .replace('<', '&lt;')
+        .replace('>', '&gt;')
+        .replace('"', '&quot;')
+        .replace('\\n', '&#10;')
+        .replace('\\r', '&#13;')
+        .replace('\\t', '&#9;'))
 
 def _x_format_attributes(_x_append_markup, attributes):
     """ Emits dynamic attributes at runtime
     """
-    global _x_escape_attribute
+    global _x_xml_escape_attribute
 
     for attribute_name, attribute_value in attributes.iteritems():
         if attribute_value is not None:
             _x_append_markup(' %%s="%%s"' %% (
-                attribute_name, _x_escape_attribute(attribute_value)))
+                attribute_name, _x_xml_escape_attribute(attribute_value)))
 '''    
     
     # No module footer needed
     
 class FunctionDefinitionBlock(base_blocks.FunctionDefinitionBlock):
-    __slots__ = base_blocks.FunctionDefinitionBlock.__slots__
+    __slots__ = ()
     
     # Function body header
-    # NOTE: Do NOT add gettext_translator to the list of globals!
+    # NOTE: The helper functions are bound to local variables, since
+    #       looking up local variables is faster than looking up globals.
+    #       They are called once or twice for each expression rendered.
+    # NOTE: Do NOT bind gettext_translator to a local variable here!
     #       That can be owerridden by a parameter, it is intentional!
     header_template = '''\
-global _x_to_text, _x_escape_text
+_x_to_text = _x_convert_to_text
+_x_escape_text = _x_xml_escape_text
+_x_escape_attribute = _x_xml_escape_attribute
 
 _x_markup_fragments = []
 _x_append_markup = _x_markup_fragments.append
@@ -90,9 +109,8 @@ return u''
 '''
     
     def format(self, depth=0):
-        lines = (
-            [(depth, 'def %s:' % self.data)] +
-            base_blocks.FunctionDefinitionBlock.format(self, depth + 1))
+        lines = [(depth, 'def %s:' % self.data)]
+        lines.extend(base_blocks.FunctionDefinitionBlock.format(self, depth + 1))
         
         if constants.GENERATE_DEBUG_COMMENTS:
             self.insert_debug_comment(lines, depth)
@@ -100,12 +118,11 @@ return u''
         return lines
     
 class LoopBlock(base_blocks.LoopBlock):
-    __slots__ = base_blocks.LoopBlock.__slots__
+    __slots__ = ()
     
     def format(self, depth=0):
-        lines = (
-            [(depth, 'for %s:' % self.data)] +
-            base_blocks.LoopBlock.format(self, depth + 1))
+        lines = [(depth, 'for %s:' % self.data)]
+        self.format_children(depth + 1, lines)
         
         if constants.GENERATE_DEBUG_COMMENTS:
             self.insert_debug_comment(lines, depth)
@@ -113,12 +130,11 @@ class LoopBlock(base_blocks.LoopBlock):
         return lines
 
 class ConditionalBlock(base_blocks.ConditionalBlock):
-    __slots__ = base_blocks.ConditionalBlock.__slots__
+    __slots__ = ()
     
     def format(self, depth=0):
-        lines = (
-            [(depth, 'if %s:' % self.data)] +
-            base_blocks.ConditionalBlock.format(self, depth + 1))
+        lines = [(depth, 'if %s:' % self.data)]
+        self.format_children(depth + 1, lines)
 
         if constants.GENERATE_DEBUG_COMMENTS:
             self.insert_debug_comment(lines, depth)
@@ -126,7 +142,7 @@ class ConditionalBlock(base_blocks.ConditionalBlock):
         return lines
     
 class SwitchBlock(base_blocks.SwitchBlock):
-    __slots__ = base_blocks.SwitchBlock.__slots__
+    __slots__ = ()
     
     def format(self, depth=0):
         
@@ -147,16 +163,13 @@ class SwitchBlock(base_blocks.SwitchBlock):
 
         return lines
     
-    def format_if_elif_else(self,
-                            depth,
-                            expression='',
-                            counter=itertools.count()):
+    def format_if_elif_else(self, depth, expression=''):
         """ The test expression is empty, so we test for truth values only
         """
         lines = []
 
         if expression:
-            index = counter.next()
+            index = next_switch_index()
             variable_name = '_x_switch_%d' % index
             lines.append((depth, '%s = %s' % (variable_name, expression)))
         
@@ -166,40 +179,46 @@ class SwitchBlock(base_blocks.SwitchBlock):
                 condition = '%s == (%s)' % (variable_name, when_block.data)
             else:
                 condition = when_block.data
-            when_lines = [(depth, '%s %s:' % (statement, condition))]
-            when_lines.extend(when_block.format(depth + 1))
             if constants.GENERATE_DEBUG_COMMENTS:
+                when_lines = [(depth, '%s %s:' % (statement, condition))]
+                when_block.format_children(depth + 1, when_lines)
                 when_block.insert_debug_comment(when_lines, depth)
-            lines.extend(when_lines)
+                lines.extend(when_lines)
+            else:
+                lines.append((depth, '%s %s:' % (statement, condition)))
+                when_block.format_children(depth + 1, lines)
         
         if self.otherwise_blocks:
-            otherwise_lines = (
-                [(depth, 'else:')] +
-                self.otherwise_blocks[0].format(depth + 1))
+            otherwise_block = self.otherwise_blocks[0]
             if constants.GENERATE_DEBUG_COMMENTS:
-                self.otherwise_blocks[0].insert_debug_comment(otherwise_lines, depth)
-            lines.extend(otherwise_lines)
+                otherwise_lines = [(depth, 'else:')]
+                otherwise_block.format_children(depth + 1, otherwise_lines)
+                otherwise_block.insert_debug_comment(otherwise_lines, depth)
+                lines.extend(otherwise_lines)
+            else:
+                lines.append((depth, 'else:'))
+                otherwise_block.format_children(depth + 1, lines)
             
         return lines
 
 class CaseBlock(base_blocks.CaseBlock):
-    __slots__ = base_blocks.CaseBlock.__slots__
+    __slots__ = ()
     
 class OtherwiseBlock(base_blocks.OtherwiseBlock):
-    __slots__ = base_blocks.OtherwiseBlock.__slots__
+    __slots__ = ()
 
 class WithBlock(base_blocks.WithBlock):
-    __slots__ = base_blocks.WithBlock.__slots__
+    __slots__ = ()
     
-    def format(self, depth=0, counter=itertools.count()):
-        index = counter.next()
+    def format(self, depth=0):
+        index = next_with_index()
         function_name = '_x_with_%d' % index
         
-        lines = (
-            [(depth, 'def %s():' % function_name),
-             (depth + 1, self.data)] +
-            base_blocks.WithBlock.format(self, depth + 1) +
-            [(depth, '%s()' % function_name)])
+        lines = [
+            (depth, 'def %s():' % function_name),
+            (depth + 1, self.data)]
+        self.format_children(depth + 1, lines)
+        lines.append((depth, '%s()' % function_name))
         
         if constants.GENERATE_DEBUG_COMMENTS:
             self.insert_debug_comment(lines, depth)
@@ -209,9 +228,9 @@ class WithBlock(base_blocks.WithBlock):
 ### Element hierarchy    
     
 class ElementBlock(base_blocks.ElementBlock):
-    __slots__ = base_blocks.ElementBlock.__slots__
+    __slots__ = ()
     
-    def format(self, depth=0, counter=itertools.count()):
+    def format(self, depth=0):
         lines = []
         
         if self.start_tag:
@@ -220,7 +239,7 @@ class ElementBlock(base_blocks.ElementBlock):
             #       static truth values here, only expressions have to be
             #       evaluated at runtime.
             if self.strip_expression:
-                index = counter.next()
+                index = next_keep_index()
                 variable_name = '_x_keep_%d' % index
                 lines.append((depth, '%s = not (%s)' % (variable_name, self.strip_expression)))
                 lines.append((depth, 'if %s:' % variable_name))
@@ -228,7 +247,7 @@ class ElementBlock(base_blocks.ElementBlock):
             else:
                 lines.extend(self.start_tag.format(depth))
                 
-        lines.extend(base_blocks.ElementBlock.format(self, depth))
+        self.format_children(depth, lines)
         
         if self.end_tag:
             if self.strip_expression:
@@ -243,92 +262,105 @@ class ElementBlock(base_blocks.ElementBlock):
         return lines
 
 class OpeningTagBlock(base_blocks.OpeningTagBlock):
-    __slots__ = base_blocks.OpeningTagBlock.__slots__
+    __slots__ = ()
 
 class ClosingTagBlock(base_blocks.ClosingTagBlock):
-    __slots__ = base_blocks.ClosingTagBlock.__slots__
+    __slots__ = ()
     
 class AttributeValueBlock(base_blocks.AttributeValueBlock):
-    __slots__ = base_blocks.AttributeValueBlock.__slots__
+    __slots__ = ()
     
 ### Generated source code blocks
     
 class MarkupBlock(base_blocks.MarkupBlock):
-    __slots__ = base_blocks.MarkupBlock.__slots__
+    __slots__ = ()
     
     def format(self, depth=0):
-        lines = [(depth, '_x_append_markup(%r)' % self.data)]
-        
-        if constants.GENERATE_DEBUG_COMMENTS:
-            self.insert_debug_comment(lines, depth)
-            
-        return lines
+        return [(depth, '_x_append_markup(%r)' % self.data)]
     
 class AttributeValueFragmentBlock(base_blocks.AttributeValueFragmentBlock):
-    __slots__ = base_blocks.AttributeValueFragmentBlock.__slots__
+    __slots__ = ()
     
     def format(self, depth=0):
-        lines = [(depth, '_x_append_markup(%r)' % util.escape_attribute(self.data))]
-        
-        if constants.GENERATE_DEBUG_COMMENTS:
-            self.insert_debug_comment(lines, depth)
-            
-        return lines
+        return [(depth, '_x_append_markup(%r)' % util.escape_attribute(self.data))]
 
 class TextBlock(base_blocks.TextBlock):
-    __slots__ = base_blocks.TextBlock.__slots__
+    __slots__ = ()
     
     def format(self, depth=0):
-        lines = [(depth, '_x_append_markup(%r)' % util.escape_text(self.data))]
-        
-        if constants.GENERATE_DEBUG_COMMENTS:
-            self.insert_debug_comment(lines, depth)
-            
-        return lines
+        return [(depth, '_x_append_markup(%r)' % util.escape_text(self.data))]
+    
+class LiteralMarkupBlock(base_blocks.LiteralMarkupBlock, MarkupBlock):
+    __slots__ = ()
+
+class LiteralAttributeValueFragmentBlock(
+    base_blocks.LiteralAttributeValueFragmentBlock, AttributeValueFragmentBlock):
+    __slots__ = ()
+
+class LiteralTextBlock(base_blocks.LiteralTextBlock, TextBlock):
+    __slots__ = ()
     
 class MarkupExpressionBlock(base_blocks.MarkupExpressionBlock):
-    __slots__ = base_blocks.MarkupExpressionBlock.__slots__
+    __slots__ = ()
     
     def format(self, depth=0):
-        lines = [(depth, '_x_append_markup(%s)' % self.data)]
-        
-        if constants.GENERATE_DEBUG_COMMENTS:
-            self.insert_debug_comment(lines, depth)
-            
-        return lines
+        return [(depth, '_x_append_markup(%s)' % self.data)]
     
 class TextExpressionBlock(base_blocks.TextExpressionBlock):
-    __slots__ = base_blocks.TextExpressionBlock.__slots__
+    __slots__ = ()
     
     def format(self, depth=0):
-        lines = [(depth, '_x_append_markup(_x_escape_text(_x_to_text(%s)))' % self.data)]
-        
-        if constants.GENERATE_DEBUG_COMMENTS:
-            self.insert_debug_comment(lines, depth)
-            
-        return lines
+        return [(depth, '_x_append_markup(_x_escape_text(_x_to_text(%s)))' % self.data)]
 
 class AttributeExpressionBlock(base_blocks.AttributeExpressionBlock):
-    __slots__ = base_blocks.AttributeExpressionBlock.__slots__
+    __slots__ = ()
     
     def format(self, depth=0):
-        lines = [(depth, '_x_append_markup(_x_escape_attribute(_x_to_text(%s)))' % self.data)]
-        
-        if constants.GENERATE_DEBUG_COMMENTS:
-            self.insert_debug_comment(lines, depth)
-            
-        return lines
+        return [(depth, '_x_append_markup(_x_escape_attribute(_x_to_text(%s)))' % self.data)]
     
 class DynamicAttributesBlock(base_blocks.DynamicAttributesBlock):
-    __slots__ = base_blocks.DynamicAttributesBlock.__slots__
+    __slots__ = ()
     
     def format(self, depth=0):
-        lines = [(depth, '_x_format_attributes(_x_append_markup, %s)' % self.data)]
         
-        if constants.GENERATE_DEBUG_COMMENTS:
-            self.insert_debug_comment(lines, depth)
-            
+        # Emit the attributes one by one if their names are known at compile
+        # time, it avoids building and iterating over the dictionary
+        attribute_items = util.split_dict_literal(self.data)
+        if attribute_items is None:
+            lines = [(depth, '_x_format_attributes(_x_append_markup, %s)' % self.data)]
+        else:
+            lines = []
+            for attribute_name, value_expression in attribute_items:
+                attribute_markup = u' %s="%%s"' % attribute_name.replace('%', '%%')
+                # NOTE: The expressions must be ASCII, since the generated
+                #       source code is ASCII, see get_ascii_expression.
+                lines.append((depth, '_x_attribute_value = (%s)' % value_expression.encode('ascii')))
+                lines.append((depth, 'if _x_attribute_value is not None:'))
+                lines.append((depth + 1, '_x_append_markup(%r %% _x_escape_attribute(_x_attribute_value))' % attribute_markup))
+        
         return lines
 
 class StaticCodeBlock(base_blocks.StaticCodeBlock):
-    __slots__ = base_blocks.StaticCodeBlock.__slots__
+    __slots__ = ()
+
+# Add the debug comments to the source code lines of the generated source
+# code blocks only if enabled, so they don't need to check it one by one
+if constants.GENERATE_DEBUG_COMMENTS:
+    
+    def format_with_debug_comment(format):
+        def format_with_debug_comment(self, depth=0):
+            lines = format(self, depth)
+            self.insert_debug_comment(lines, depth)
+            return lines
+        return format_with_debug_comment
+    
+    for block_class in (
+        MarkupBlock,
+        AttributeValueFragmentBlock,
+        TextBlock,
+        MarkupExpressionBlock,
+        TextExpressionBlock,
+        AttributeExpressionBlock,
+        DynamicAttributesBlock):
+        
+        block_class.format = format_with_debug_comment(block_class.format)
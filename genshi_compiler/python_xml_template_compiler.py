@@ -6,6 +6,8 @@ License: MIT
 
 """
 
+import imp
+
 import base_xml_template_compiler, python_blocks
 
 
@@ -20,3 +22,28 @@ class PythonXMLTemplateCompiler(base_xml_template_compiler.BaseXMLTemplateCompil
     
     # Generate Python source code blocks
     blocks_module = python_blocks
+    
+    def compile_module(self,
+                       arguments='',
+                       output_standard='xhtml',
+                       module_name=None):
+        """ Compiles the previously loaded template into a Python module
+        in memory, without having to save and import the generated source
+        
+        module_name: Name of the module object to create, defaults to
+            the template identifier.
+        
+        See the compile method for the other parameters.
+        
+        Returns the module object. Call its `render` function or any of
+        the template functions defined to render the template.
+        
+        """
+        module_source = self.compile(arguments, output_standard)
+        
+        module = imp.new_module(module_name or self.template_identifier)
+        module_code = compile(
+            module_source, '<compiled %s>' % self.template_filename, 'exec')
+        exec module_code in module.__dict__
+        
+        return module
@@ -8,7 +8,7 @@ Provides context independent utility functions.
 
 """
 
-import difflib, xml.sax.saxutils
+import ast, difflib, tokenize, xml.sax.saxutils
 
 import constants, util
 
@@ -17,15 +17,28 @@ import constants, util
 escape_text = xml.sax.saxutils.escape
 unescape_xml = xml.sax.saxutils.unescape
 
-def escape_attribute(value, quoteattr=xml.sax.saxutils.quoteattr):
+def escape_attribute(value):
     """ Escapes a value to be usitable for double quoted XML attributes
+    
+    It is equivalent to xml.sax.saxutils.quoteattr without the quotes,
+    but avoids the copying of the entity map and the quoted string.
+    The ampersand must be replaced first.
+    
     """
-    return quoteattr("'" + value)[2: -1]
+    return (
+        value
+        .replace('&', '&amp;')
+        .replace('<', '&lt;')
+        .replace('>', '&gt;')
+        .replace('"', '&quot;')
+        .replace('\n', '&#10;')
+        .replace('\r', '&#13;')
+        .replace('\t', '&#9;'))
 
 def is_identifier(name):
     """ Returns True if the given name is acceptable as a Python identifier
     """
-    return constants.RX_IDENTIFIER.match(name)
+    return constants.RX_IDENTIFIER.match(name) is not None
 
 def namespace_url_to_prefix(nsmap, full_name):
     """ Maps tag or attribute name from the long namespace reference (URL)
@@ -58,31 +71,43 @@ def split_source_to_lines(source_text, depth=0, tab_size=8):
     """
     # Split the source code to lines.
     # Also remove trailing whitespace and convert all tabs to spaces.
-    code_line_list = [
-        util.tab_to_space(code_line.rstrip(), tab_size)
-        for code_line in source_text.split('\n')]
-    
-    # Count whitespace at the beginning of each line
-    code_line_with_whitespace_count_list = [
-        (code_line,
-         len(constants.RX_LEFT_WHITESPACE.match(code_line).group(1)))
-        for code_line in code_line_list]
-    
-    # Determine the common indentation
-    common_indentation = min(
-        whitespace_count
-        for code_line, whitespace_count in code_line_with_whitespace_count_list)
+    # Determine the common indentation in the same pass, but ignore the
+    # empty lines, since they don't have any indentation.
+    whitespace_characters = constants.WHITESPACE_CHARACTERS
+    code_line_list = []
+    common_indentation = None
+    for code_line in source_text.split('\n'):
+        code_line = code_line.rstrip().expandtabs(tab_size)
+        code_line_list.append(code_line)
+        if code_line:
+            indentation = len(code_line) - len(code_line.lstrip(whitespace_characters))
+            if common_indentation is None or indentation < common_indentation:
+                common_indentation = indentation
     
     # Remove common indentation by dedenting all the lines
-    lines = [
-        (depth, code_line[common_indentation:])
-        for code_line in code_line_list]
+    if common_indentation:
+        lines = [
+            (depth, code_line[common_indentation:])
+            for code_line in code_line_list]
+    else:
+        lines = [
+            (depth, code_line)
+            for code_line in code_line_list]
     
     return lines
 
 def tab_to_space(code_line, tab_size=8):
     """ Replaces tabulators with spaces
+    
+    The tab positions are counted from the start of the string, even after
+    a newline or carriage return character.
+    
     """
+    # NOTE: The expandtabs method restarts counting the columns after each
+    #       newline and carriage return, so it is used only without those.
+    if '\n' not in code_line and '\r' not in code_line:
+        return code_line.expandtabs(tab_size)
+    
     # Look up each tab character one by one
     while 1:
         
@@ -110,11 +135,9 @@ def parse_boolean_expression(expression, default=None):
     if not expression:
         return default
     
-    if expression.lower() == 'true':
-        return True
-    
-    if expression.lower() == 'false':
-        return False
+    boolean_value = constants.BOOLEAN_CONSTANT_MAP.get(expression.lower())
+    if boolean_value is not None:
+        return boolean_value
     
     if expression.isdigit():
         return bool(int(expression))
@@ -137,9 +160,14 @@ def reduce_whitespace(whitespace):
 
 def remove_duplicate_whitespace(text):
     """ Removes all the duplicate whitespace and newline characters
+    
+    Whitespace containing a newline is reduced to a single newline first,
+    then the remaining duplicate whitespace is reduced to a single space.
+    Both substitutions use a constant replacement, no Python callback.
+    
     """
-    return constants.RX_DUPLICATE_WHITESPACE.subn(
-        lambda m: reduce_whitespace(m.group(0)), text)[0]
+    text = constants.RX_NEWLINE_WHITESPACE.sub('\n', text)
+    return constants.RX_DUPLICATE_BLANKS.sub(' ', text)
 
 def separate_whitespace(text):
     """ Separates the leading and trailing whitespace
@@ -150,9 +178,154 @@ def separate_whitespace(text):
     empty_string = text[:0]
     if not text.strip():
         return (text, empty_string, empty_string)
-    left, center, right = constants.RX_LEFT_RIGHT_WHITESPACE.match(text).groups()
-    return (left, center or empty_string, right or empty_string)
+    whitespace_characters = constants.WHITESPACE_CHARACTERS
+    center = text.strip(whitespace_characters)
+    left_length = len(text) - len(text.lstrip(whitespace_characters))
+    right_index = left_length + len(center)
+    return (text[:left_length], center, text[right_index:])
+
+def replace_i18n_msg_elements(string_template):
+    """ Replaces the [1:...] element templates in an i18n:msg string
+    template with %(start:1)s...%(end:1)s items in a single pass
+    
+    Nested element templates are closed in reverse order. Brackets
+    not belonging to an element template are kept as they are.
+    
+    """
+    parts = []
+    open_elements = []
+    position = 0
+    
+    for match in constants.RX_I18N_MSG_ELEMENT.finditer(string_template):
+        element_number = match.group(1)
+        if element_number is None and not open_elements:
+            # Closing bracket outside of element templates
+            continue
+        
+        parts.append(string_template[position: match.start()])
+        if element_number is None:
+            part_index, element_number = open_elements.pop()
+            parts.append(u'%%(end:%s)s' % element_number)
+        else:
+            open_elements.append((len(parts), element_number))
+            parts.append(u'%%(start:%s)s' % element_number)
+        position = match.end()
+    
+    parts.append(string_template[position:])
+    
+    # Element templates never closed are kept as they are
+    for part_index, element_number in open_elements:
+        parts[part_index] = u'[%s:' % element_number
+    
+    return u''.join(parts)
+
+def split_dict_literal(expression):
+    """ Splits a dictionary display with constant string keys, like
+    {'class': css_class, 'id': item_id}, to its items
+    
+    Returns the list of (key, value_expression) pairs in source order.
+    Returns None if the expression is anything else, like a variable,
+    a function call, a dict comprehension or a dictionary with computed,
+    duplicate or non-UTF-8 byte string keys.
+    
+    """
+    expression = expression.strip()
+    
+    try:
+        node = ast.parse(expression, mode='eval').body
+    except SyntaxError:
+        return None
+    
+    if not isinstance(node, ast.Dict):
+        return None
+    
+    key_list = []
+    for key_node in node.keys:
+        if not isinstance(key_node, ast.Str):
+            return None
+        key = key_node.s
+        # NOTE: The non-ASCII byte string keys of a unicode expression are
+        #       UTF-8 encoded by the Python 2 parser, so they are decoded
+        #       to get the same key as the runtime would format.
+        if isinstance(key, str):
+            try:
+                key = key.decode('utf-8')
+            except UnicodeDecodeError:
+                return None
+        key_list.append(key)
+        
+    if len(set(key_list)) != len(key_list):
+        return None
+    
+    # Find the value expressions by tokenizing the source, since the AST
+    # nodes do not have their end position in Python 2
+    source_lines = expression.splitlines(True)
+    line_offsets = [0]
+    for source_line in source_lines:
+        line_offsets.append(line_offsets[-1] + len(source_line))
+    
+    value_list = []
+    depth = 0
+    value_offset = None
+    for token_type, token_string, start, end, line in tokenize.generate_tokens(
+        iter(source_lines).next):
+        
+        if token_type != tokenize.OP:
+            continue
+        
+        if token_string in ('(', '[', '{'):
+            depth += 1
+            
+        elif token_string in (')', ']', '}'):
+            depth -= 1
+            if not depth and value_offset is not None:
+                # End of the last value without a trailing comma
+                value_list.append(
+                    expression[value_offset: line_offsets[start[0] - 1] + start[1]])
+                value_offset = None
+                
+        elif depth == 1:
+            if token_string == ':' and value_offset is None:
+                # Start of a value, colons inside the value (lambda) are skipped
+                value_offset = line_offsets[end[0] - 1] + end[1]
+            elif token_string == ',' and value_offset is not None:
+                # End of a value
+                value_list.append(
+                    expression[value_offset: line_offsets[start[0] - 1] + start[1]])
+                value_offset = None
+                
+    if len(value_list) != len(key_list):
+        return None
+    
+    return [
+        (key, value.strip())
+        for key, value in zip(key_list, value_list)]
 
+def evaluate_literal_text(expression):
+    """ Evaluates a string or number literal expression at compile time
+    
+    Returns the text the expression would be converted to at runtime as
+    unicode. Returns None if the expression is not a string or number
+    literal or it can't be converted to unicode.
+    
+    """
+    if not constants.RX_LITERAL_START.match(expression):
+        return None
+    
+    try:
+        value = ast.literal_eval(expression)
+    except (ValueError, SyntaxError):
+        return None
+    
+    if not isinstance(value, (basestring, int, long, float)):
+        return None
+    
+    try:
+        return unicode(value)
+    except UnicodeDecodeError:
+        # Leave the error to the runtime, like for any other expression
+        return None
+    
 def print_diff(a_text, b_text, a_label, b_label):
     """ Returns printable unified diff of two multiline text values
     """
@@ -165,9 +338,14 @@ def print_diff(a_text, b_text, a_label, b_label):
         b_text += '\n'
 
     # Determine and print unified diff
-    print ''.join(
-        difflib.unified_diff(
-            a_text.splitlines(1),
-            b_text.splitlines(1),
-            a_label,
-            b_label))
+    # NOTE: The diff lines are printed as they are generated, so the whole
+    #       diff is never joined into a single string. They are printed
+    #       instead of written to sys.stdout, since print encodes unicode
+    #       lines with the encoding of the output stream.
+    for diff_line in difflib.unified_diff(
+        a_text.splitlines(1),
+        b_text.splitlines(1),
+        a_label,
+        b_label):
+        print diff_line,
+    print
@@ -1,3 +1,4 @@
+import os
 import setuptools
 
 # Get version info
@@ -5,6 +6,16 @@ __version__ = None
 __release__ = None
 exec open('genshi_compiler/version.py')
 
+# Optionally compile the template compiler module with Cython to speed up
+# the compilation of templates, the pure Python module is used otherwise.
+# Set the GENSHI_COMPILER_CYTHON environment variable to enable it.
+ext_modules = []
+if os.environ.get('GENSHI_COMPILER_CYTHON'):
+    from Cython.Build import cythonize
+    ext_modules = cythonize(
+        ['genshi_compiler/base_xml_template_compiler.py'],
+        compiler_directives=dict(language_level=2))
+
 setuptools.setup(
     name='genshi-compiler',
     version=__release__,
@@ -39,6 +50,7 @@ and the i18n:msg directive.''',
     url='https://github.com/viktor-ferenczi/genshi-compiler/',
     license='MIT',
     packages=['genshi_compiler'],
+    ext_modules=ext_modules,
     test_suite='unittest',
     zip_safe=False,
     install_requires=['lxml'],
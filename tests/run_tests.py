@@ -1,36 +1,28 @@
 """ Runs all the unit test cases
 """
 
-import os, unittest
+import os, sys, unittest
 
-def import_test_cases():
-    """ Imports test cases from all the local modules
+def load_test_suite():
+    """ Loads the test cases from all the local test modules
     """
-    print 'Importing test cases:'
-    print
-    
     # Discover test modules
-    test_module_name_list = [
+    # NOTE: The loader's discover method is not used, since it is not
+    #       available before Python 2.7.
+    test_module_name_list = sorted(
         fn[:-3]
-        for fn in os.listdir('.') 
-        if fn.startswith('test_') and fn.endswith('.py')]
-    
-    # Import test cases into the global namespace
-    global_namespace = globals()
+        for fn in os.listdir('.')
+        if fn.startswith('test_') and fn.endswith('.py'))
+
+    # Load the test cases of each module
+    test_loader = unittest.TestLoader()
+    test_suite = unittest.TestSuite()
     for test_module_name in test_module_name_list:
-        print ' - from %s:' % test_module_name
         test_module = __import__(test_module_name)
-        for name in dir(test_module):
-            obj = getattr(test_module, name)
-            if type(obj) is type and issubclass(obj, (unittest.TestCase, unittest.TestSuite)):
-                print '   %s' % name
-                global_namespace[name] = obj
-        print
-        
-    print 'Done importing test cases.'
+        test_suite.addTests(test_loader.loadTestsFromModule(test_module))
+
+    return test_suite
 
 if __name__ == '__main__':
-    import_test_cases()
-    print
-    print 'Running test cases:'
-    unittest.main()
+    result = unittest.TextTestRunner(verbosity=2).run(load_test_suite())
+    sys.exit(not result.wasSuccessful())
@@ -33,6 +33,17 @@ class HtmlMinimizerTestCase(unittest.TestCase):
         self.assertEquals(html_minimizer.minimize('<html> \n x \n </html>'), '<html> x </html>')
         self.assertEquals(html_minimizer.minimize('<html> \n </html>'), '<html>\n</html>')
         self.assertEquals(html_minimizer.minimize('<html> \n\n \n  \n \n  </html>'), '<html>\n</html>')
+    
+    def test_unicode_markup(self):
+        self.assertEquals(
+            html_minimizer.minimize(u'<html> \u00e1rv\u00edzt\u0171r\u0151 &amp; &nbsp;&eacute; </html>'),
+            '<html> &#225;rv&#237;zt&#369;r&#337; &amp; &#160;&#233; </html>')
+        self.assertEquals(
+            html_minimizer.minimize(u'<html title="\u00e9 &lt;">\n <p>\u20ac</p> \n</html>'),
+            '<html title="&#233; &lt;">\n<p>&#8364;</p>\n</html>')
+        self.assertEquals(
+            html_minimizer.minimize('<html> \xc3\xa1 &amp; &eacute; </html>'),
+            '<html> &#225; &amp; &#233; </html>')
 
 if __name__ == '__main__':
     unittest.main()
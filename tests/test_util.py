@@ -28,7 +28,28 @@ class UtilityTestCase(unittest.TestCase):
         self.assertEquals(util.escape_attribute(">"), '&gt;')
         self.assertEquals(util.escape_attribute('"'), '&quot;')
         self.assertEquals(util.escape_attribute("'"), "'")
+        self.assertEquals(util.escape_attribute("\n"), '&#10;')
+        self.assertEquals(util.escape_attribute("\r"), '&#13;')
+        self.assertEquals(util.escape_attribute("\t"), '&#9;')
+        self.assertEquals(util.escape_attribute(u'a&"b"'), u'a&amp;&quot;b&quot;')
     
+    def test_is_identifier(self):
+        self.assertEquals(util.is_identifier('x'), True)
+        self.assertEquals(util.is_identifier('_x_1'), True)
+        self.assertEquals(util.is_identifier('Template'), True)
+        self.assertEquals(util.is_identifier(''), False)
+        self.assertEquals(util.is_identifier('1x'), False)
+        self.assertEquals(util.is_identifier('x-y'), False)
+        self.assertEquals(util.is_identifier('x\n'), False)
+        
+    def test_split_source_to_lines(self):
+        self.assertEquals(util.split_source_to_lines(''), [(0, '')])
+        self.assertEquals(util.split_source_to_lines('x = 1'), [(0, 'x = 1')])
+        self.assertEquals(util.split_source_to_lines('x = 1', 2), [(2, 'x = 1')])
+        self.assertEquals(util.split_source_to_lines('  x = 1  \n  y = 2'), [(0, 'x = 1'), (0, 'y = 2')])
+        self.assertEquals(util.split_source_to_lines('  if x:\n\ty = 2'), [(0, 'if x:'), (0, '      y = 2')])
+        self.assertEquals(util.split_source_to_lines('\n    x = 1\n\n    y = 2\n  '), [(0, ''), (0, 'x = 1'), (0, ''), (0, 'y = 2'), (0, '')])
+        
     def test_tab_to_space(self):
         self.assertEquals(util.tab_to_space(''),  '')
         self.assertEquals(util.tab_to_space(' '),  ' ')
@@ -41,6 +62,18 @@ class UtilityTestCase(unittest.TestCase):
         self.assertEquals(util.tab_to_space('x\ty'),  'x' + ' ' * 7 + 'y')
         self.assertEquals(util.tab_to_space('x\ty'),  'x' + ' ' * 7 + 'y')
         self.assertEquals(util.tab_to_space('x\tya\tb'),  'x' + ' ' * 7 + 'ya' + ' ' * 6 + 'b')
+        self.assertEquals(util.tab_to_space('\ta\t\r\x0c\tb\x0c'),  ' ' * 8 + 'a' + ' ' * 7 + '\r\x0c' + ' ' * 6 + 'b\x0c')
+        self.assertEquals(util.tab_to_space('x\n\ty'),  'x\n' + ' ' * 6 + 'y')
+        
+    def test_parse_boolean_expression(self):
+        self.assertEquals(util.parse_boolean_expression(''), None)
+        self.assertEquals(util.parse_boolean_expression(' ', False), False)
+        self.assertEquals(util.parse_boolean_expression('True'), True)
+        self.assertEquals(util.parse_boolean_expression(' tRUE '), True)
+        self.assertEquals(util.parse_boolean_expression('false'), False)
+        self.assertEquals(util.parse_boolean_expression('0'), False)
+        self.assertEquals(util.parse_boolean_expression('2'), True)
+        self.assertEquals(util.parse_boolean_expression(' x.y '), 'x.y')
         
     def test_remove_duplicate_whitespace(self):
         self.assertEquals(util.remove_duplicate_whitespace(''), '')
@@ -63,6 +96,46 @@ class UtilityTestCase(unittest.TestCase):
         self.assertEquals(util.separate_whitespace('x\t '), ('', 'x', '\t '))
         self.assertEquals(util.separate_whitespace('\t x \n'), ('\t ', 'x', ' \n'))
         
+    def test_replace_i18n_msg_elements(self):
+        self.assertEquals(util.replace_i18n_msg_elements(u''), u'')
+        self.assertEquals(util.replace_i18n_msg_elements(u'x'), u'x')
+        self.assertEquals(util.replace_i18n_msg_elements(u'[1:x]'), u'%(start:1)sx%(end:1)s')
+        self.assertEquals(util.replace_i18n_msg_elements(u'[1:x] [2:y]'), u'%(start:1)sx%(end:1)s %(start:2)sy%(end:2)s')
+        self.assertEquals(util.replace_i18n_msg_elements(u'[1:x [2:y] z]'), u'%(start:1)sx %(start:2)sy%(end:2)s z%(end:1)s')
+        self.assertEquals(util.replace_i18n_msg_elements(u'[1:x\ny]'), u'%(start:1)sx\ny%(end:1)s')
+        self.assertEquals(util.replace_i18n_msg_elements(u'x] [y'), u'x] [y')
+        self.assertEquals(util.replace_i18n_msg_elements(u'[1:x'), u'[1:x')
+        
+    def test_evaluate_literal_text(self):
+        self.assertEquals(util.evaluate_literal_text("'abc'"), u'abc')
+        self.assertEquals(util.evaluate_literal_text('u"a<b"'), u'a<b')
+        self.assertEquals(util.evaluate_literal_text("''"), u'')
+        self.assertEquals(util.evaluate_literal_text('42'), u'42')
+        self.assertEquals(util.evaluate_literal_text('-1.5'), u'-1.5')
+        self.assertEquals(util.evaluate_literal_text('name'), None)
+        self.assertEquals(util.evaluate_literal_text('user.name'), None)
+        self.assertEquals(util.evaluate_literal_text("'%s' % name"), None)
+        self.assertEquals(util.evaluate_literal_text('True'), None)
+        self.assertEquals(util.evaluate_literal_text('[1]'), None)
+        self.assertEquals(util.evaluate_literal_text("'\\xe9'"), None)
+        
+    def test_split_dict_literal(self):
+        self.assertEquals(util.split_dict_literal('{}'), [])
+        self.assertEquals(util.split_dict_literal("{'a': x}"), [('a', 'x')])
+        self.assertEquals(util.split_dict_literal(" {'a': x, 'b': y, } "), [('a', 'x'), ('b', 'y')])
+        self.assertEquals(util.split_dict_literal("{'a': f(x, y), 'b': {'c': 1}[z]}"), [('a', 'f(x, y)'), ('b', "{'c': 1}[z]")])
+        self.assertEquals(util.split_dict_literal("{'a': lambda x: x, 'b': 'c:d'}"), [('a', 'lambda x: x'), ('b', "'c:d'")])
+        self.assertEquals(util.split_dict_literal("{'a':\n (x +\n y)}"), [('a', '(x +\n y)')])
+        self.assertEquals(util.split_dict_literal('attrs'), None)
+        self.assertEquals(util.split_dict_literal('dict(a=x)'), None)
+        self.assertEquals(util.split_dict_literal('{k: x}'), None)
+        self.assertEquals(util.split_dict_literal("{'a': x, 'a': y}"), None)
+        self.assertEquals(util.split_dict_literal('{k: v for k, v in x}'), None)
+        self.assertEquals(util.split_dict_literal("{'a': x"), None)
+        self.assertEquals(util.split_dict_literal(u"{'caf\xe9': x}"), [(u'caf\xe9', u'x')])
+        self.assertEquals(util.split_dict_literal("{u'caf\\xe9': x}"), [(u'caf\xe9', 'x')])
+        self.assertEquals(util.split_dict_literal("{'caf\xe9': x}"), None)
+        
     # TODO: Test all the other functions
 
 if __name__ == '__main__':